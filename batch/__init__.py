@@ -0,0 +1 @@
+from .batch_runner import BatchCheckpoint, list_match_videos, load_models, run_batch
@@ -0,0 +1,244 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append("../")
+from court_line_detector import CourtLineDetector
+
+# Extensions of the files picked up from a directory of matches
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".ts")
+
+# Models of the current worker process, loaded once by init_batch_worker
+_worker_models = {}
+
+
+# Lists the match videos of a batch: the video files of a directory, or the paths listed in a manifest file
+# A manifest has one video path per line, relative to the manifest's directory, blank lines and lines starting with # are skipped
+def list_match_videos(source):
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if name.lower().endswith(VIDEO_EXTENSIONS)
+        )
+
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+    video_paths = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                video_paths.append(os.path.join(manifest_dir, line))
+    return video_paths
+
+
+# Gives every video its own output name in the output directory, numbering videos that share a file name
+def get_output_names(video_paths):
+    output_names = {}
+    name_counts = {}
+    for video_path in video_paths:
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        name_counts[name] = name_counts.get(name, 0) + 1
+        if name_counts[name] > 1:
+            name = f"{name}_{name_counts[name]}"
+        output_names[video_path] = name
+    return output_names
+
+
+# Loads the court keypoints model and both YOLO models
+def load_models(court_model_mode="eager", num_threads=None):
+    from ultralytics import YOLO
+
+    court_line_detector = CourtLineDetector(
+        "models/keypoints_model.pth", mode=court_model_mode, num_threads=num_threads
+    )
+    court_line_detector.load_model()
+    return {
+        "court_line_detector": court_line_detector,
+        "player_model": YOLO("yolo11x"),
+        "ball_model": YOLO("models/yolo11x_last.pt"),
+    }
+
+
+# Loads the models once per worker process, every match the worker analyses then reuses them
+def init_batch_worker(court_model_mode, num_threads):
+    _worker_models.update(load_models(court_model_mode, num_threads))
+
+
+# Analyses one match in a worker with its loaded models, returning its checkpoint entry
+# No tracker stubs are read or saved, matches analysed at once would overwrite each other's
+def analyse_match(video_path, output_video_path, metrics_path, options):
+    from main import main
+
+    start_time = time.perf_counter()
+    report = main(
+        input_video_path=video_path,
+        output_video_path=output_video_path,
+        read_from_stub=False,
+        stub_dir=None,
+        metrics_path=metrics_path,
+        models=_worker_models,
+        **options,
+    )
+    seconds = time.perf_counter() - start_time
+    frames = report["stages"].get("encode", {}).get("frames", 0)
+
+    return {
+        "video_path": video_path,
+        "status": "done",
+        "output_video_path": output_video_path,
+        "metrics_path": metrics_path,
+        "frames": frames,
+        "seconds": seconds,
+        "fps": frames / seconds if seconds > 0 else None,
+        "pid": os.getpid(),
+    }
+
+
+class BatchCheckpoint:
+    # Remembers the matches of a batch in a JSON lines file, one entry appended per finished match, so an interrupted batch resumes where it stopped
+    # The last entry of a video wins, failed matches are tried again on the next run
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self.entries = {}
+
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                for line in f:
+                    # A line cut short by an interruption is ignored
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["video_path"]] = entry
+
+    # Whether a match was analysed and its output video is still there
+    def is_done(self, video_path):
+        entry = self.entries.get(video_path)
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and os.path.exists(entry["output_video_path"])
+        )
+
+    # Appends the entry of a finished match and flushes it to disk
+    def record(self, entry):
+        self.entries[entry["video_path"]] = entry
+        with open(self.checkpoint_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# Analyses every match in a pool of worker processes that each load the models once, writing the annotated videos, metrics and a report to output_dir
+# Matches already in the checkpoint of output_dir are skipped unless resume is False
+# options are passed on to main (batch_size, projection, court_tracking...)
+def run_batch(
+    video_paths,
+    output_dir,
+    number_of_workers=2,
+    court_model_mode="eager",
+    num_threads=None,
+    output_extension=".mp4",
+    resume=True,
+    options=None,
+):
+    options = dict(options or {}, court_model_mode=court_model_mode)
+    os.makedirs(output_dir, exist_ok=True)
+    video_paths = [os.path.abspath(video_path) for video_path in video_paths]
+
+    checkpoint_path = os.path.join(output_dir, "batch_checkpoint.jsonl")
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = BatchCheckpoint(checkpoint_path)
+
+    output_names = get_output_names(video_paths)
+    pending_videos = [
+        video_path for video_path in video_paths if not checkpoint.is_done(video_path)
+    ]
+    print(
+        f"{len(video_paths) - len(pending_videos)} of {len(video_paths)} matches already done, "
+        f"{len(pending_videos)} to analyse with {number_of_workers} workers"
+    )
+
+    # Workers share the CPU cores instead of each one using all of them
+    if num_threads is None:
+        num_threads = max(1, (os.cpu_count() or 1) // number_of_workers)
+
+    start_time = time.perf_counter()
+    run_entries = []
+    if pending_videos:
+        # Spawned workers do not inherit the parent's model or torch state
+        with ProcessPoolExecutor(
+            max_workers=number_of_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_batch_worker,
+            initargs=(court_model_mode, num_threads),
+        ) as executor:
+            futures = {}
+            for video_path in pending_videos:
+                output_name = output_names[video_path]
+                future = executor.submit(
+                    analyse_match,
+                    video_path,
+                    os.path.join(output_dir, output_name + output_extension),
+                    os.path.join(output_dir, output_name + ".metrics.json"),
+                    options,
+                )
+                futures[future] = video_path
+
+            for future in as_completed(futures):
+                video_path = futures[future]
+                try:
+                    entry = future.result()
+                    print(
+                        f"{output_names[video_path]}: {entry['frames']} frames in "
+                        f"{entry['seconds']:.1f} s ({entry['fps']:.1f} fps)"
+                    )
+                except Exception as e:
+                    entry = {
+                        "video_path": video_path,
+                        "status": "failed",
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+                    print(f"{output_names[video_path]}: failed, {entry['error']}")
+                checkpoint.record(entry)
+                run_entries.append(entry)
+
+    wall_seconds = time.perf_counter() - start_time
+    report = get_batch_report(video_paths, checkpoint, run_entries, wall_seconds)
+    report["workers"] = number_of_workers
+    report["threads_per_worker"] = num_threads
+    with open(os.path.join(output_dir, "batch_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+
+# Per-match entries of the whole batch and the throughput of this run: frames, matches and video time analysed per second of wall time
+def get_batch_report(video_paths, checkpoint, run_entries, wall_seconds):
+    done_entries = [entry for entry in run_entries if entry["status"] == "done"]
+    frames = sum(entry["frames"] for entry in done_entries)
+    match_seconds = sum(entry["seconds"] for entry in done_entries)
+
+    return {
+        "matches": [
+            checkpoint.entries.get(video_path, {"video_path": video_path})
+            for video_path in video_paths
+        ],
+        "run": {
+            "matches_done": len(done_entries),
+            "matches_failed": len(run_entries) - len(done_entries),
+            "frames": frames,
+            "wall_seconds": wall_seconds,
+            "fps": frames / wall_seconds if wall_seconds > 0 else None,
+            "matches_per_hour": (
+                len(done_entries) / wall_seconds * 3600 if wall_seconds > 0 else None
+            ),
+            # Sum of the match times over the wall time: how many matches were analysed at once on average
+            "parallelism": match_seconds / wall_seconds if wall_seconds > 0 else None,
+        },
+    }
@@ -0,0 +1,478 @@
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from statistics import median
+
+import cv2
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(REPO_ROOT)
+from court_line_detector import CourtLineDetector
+from mini_court import MiniCourt
+from player_stats import PlayerStatsEngine, StatsPanel
+from trackers import BallTracker, PlayerTracker
+from utils import save_video
+
+# Court keypoints of a 1920x1080 broadcast view, so the benchmarks do not depend on the court model
+REFERENCE_COURT_KEYPOINTS = np.array(
+    [
+        572, 293, 1335, 293, 345, 857, 1575, 857, 668, 293, 530, 857, 1240, 293,
+        1390, 857, 645, 400, 1265, 400, 570, 730, 1355, 730, 955, 400, 962, 730,
+    ],
+    np.float32,
+)  # fmt: skip
+
+FRAME_SIZE = (1920, 1080)
+
+
+# Loads the detections of the shipped tracker stubs
+def load_stub_detections():
+    with open(
+        os.path.join(REPO_ROOT, "tracker_stubs/player_detections.pkl"), "rb"
+    ) as f:
+        player_detections = pickle.load(f)
+    with open(os.path.join(REPO_ROOT, "tracker_stubs/ball_detections.pkl"), "rb") as f:
+        ball_detections = pickle.load(f)
+    return player_detections, ball_detections
+
+
+# Scales the stub detections up to number_of_frames frames, playing them forwards and backwards in turn so the motion stays continuous
+# Boxes get a pixel of seeded noise so the repeats are not identical, missed ball frames stay missed
+def scale_detections(player_detections, ball_detections, number_of_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    period = 2 * len(player_detections) - 2
+
+    scaled_player_detections = []
+    scaled_ball_detections = []
+    for frame_num in range(number_of_frames):
+        position = frame_num % period
+        if position >= len(player_detections):
+            position = period - position
+
+        scaled_player_detections.append(
+            {
+                track_id: (np.asarray(bbox) + rng.normal(0, 1, 4)).tolist()
+                for track_id, bbox in player_detections[position].items()
+            }
+        )
+        scaled_ball_detections.append(
+            {
+                track_id: (np.asarray(bbox) + rng.normal(0, 1, 4)).tolist()
+                for track_id, bbox in ball_detections[position].items()
+            }
+        )
+
+    return scaled_player_detections, scaled_ball_detections
+
+
+# A reproducible 1920x1080 frame: court lines drawn from the reference keypoints over a green surface with seeded grain, so encoding has some texture to compress
+def make_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, 6, (FRAME_SIZE[1], FRAME_SIZE[0], 3))
+    frame = np.clip(np.array([60, 140, 70]) + noise, 0, 255).astype(np.uint8)
+
+    keypoints = REFERENCE_COURT_KEYPOINTS.reshape(-1, 2).astype(int)
+    for start, end in [
+        (0, 1),
+        (2, 3),
+        (0, 2),
+        (1, 3),
+        (4, 5),
+        (6, 7),
+        (8, 9),
+        (10, 11),
+        (12, 13),
+    ]:
+        cv2.line(
+            frame, tuple(keypoints[start]), tuple(keypoints[end]), (255, 255, 255), 3
+        )
+    return frame
+
+
+# Creates the trackers and the court detector, none of the benchmarked stages runs a model so none is loaded
+def make_models():
+    return (
+        PlayerTracker("yolo11x"),
+        BallTracker("models/yolo11x_last.pt"),
+        CourtLineDetector("models/keypoints_model.pth"),
+    )
+
+
+# Returns the stages to benchmark on a set of detections, as name -> (setup, run, number of frames)
+# setup prepares the inputs outside of the measurement and returns them, run(inputs) is what gets measured
+def get_stages(
+    player_detections, ball_detections, draw_frames, video_frames, output_dir
+):
+    player_tracker, ball_tracker, court_line_detector = make_models()
+    court_keypoints = REFERENCE_COURT_KEYPOINTS
+    number_of_frames = len(player_detections)
+    frame = make_frame()
+
+    # Outputs of the earlier stages are the inputs of the later ones, they are computed once here
+    filtered_player_detections = player_tracker.choose_and_filter_players(
+        court_keypoints, player_detections
+    )
+    interpolated_ball_detections = ball_tracker.interpolate_ball_positions(
+        ball_detections
+    )
+    ball_shot_frames = ball_tracker.get_ball_shot_frames(interpolated_ball_detections)
+    mini_court = MiniCourt(frame)
+    player_mini_court_detections, ball_mini_court_detections = (
+        mini_court.convert_bounding_boxes_to_mini_court_coordinates(
+            filtered_player_detections, interpolated_ball_detections, court_keypoints
+        )
+    )
+    player_stats_engine = PlayerStatsEngine(mini_court.get_width_of_mini_court())
+    player_stats_engine.add_shots(
+        ball_shot_frames, player_mini_court_detections, ball_mini_court_detections
+    )
+
+    def run_stats(_):
+        engine = PlayerStatsEngine(mini_court.get_width_of_mini_court())
+        engine.add_shots(
+            ball_shot_frames, player_mini_court_detections, ball_mini_court_detections
+        )
+        for frame_num in range(number_of_frames):
+            engine.get_frame_stats(frame_num)
+
+    # Draw passes draw draw_frames times on the same frame, cv2 drawing and sprite blending cost the same whatever is already drawn
+    def draw_pass(draw):
+        def run(draw_frame):
+            for i in range(draw_frames):
+                draw(draw_frame, i % number_of_frames)
+
+        return (lambda: frame.copy(), run, draw_frames)
+
+    stats_panel = StatsPanel()
+
+    def run_save_video(output_path):
+        save_video((frame for _ in range(video_frames)), output_path)
+
+    return {
+        "interpolate_ball_positions": (
+            lambda: ball_detections,
+            ball_tracker.interpolate_ball_positions,
+            number_of_frames,
+        ),
+        "estimate_ball_positions": (
+            lambda: ball_detections,
+            ball_tracker.estimate_ball_positions,
+            number_of_frames,
+        ),
+        "get_ball_shot_frames": (
+            lambda: interpolated_ball_detections,
+            ball_tracker.get_ball_shot_frames,
+            number_of_frames,
+        ),
+        "choose_and_filter_players": (
+            lambda: player_detections,
+            lambda detections: player_tracker.choose_and_filter_players(
+                court_keypoints, detections
+            ),
+            number_of_frames,
+        ),
+        "mini_court_keypoint": (
+            lambda: None,
+            lambda _: mini_court.convert_bounding_boxes_to_mini_court_coordinates(
+                filtered_player_detections,
+                interpolated_ball_detections,
+                court_keypoints,
+            ),
+            number_of_frames,
+        ),
+        "mini_court_homography": (
+            lambda: None,
+            lambda _: mini_court.convert_bounding_boxes_to_mini_court_coordinates(
+                filtered_player_detections,
+                interpolated_ball_detections,
+                court_keypoints,
+                projection="homography",
+            ),
+            number_of_frames,
+        ),
+        "player_stats": (lambda: None, run_stats, number_of_frames),
+        "draw_player_bboxes": draw_pass(
+            lambda frame, frame_num: player_tracker.draw_bboxes_on_frame(
+                frame, filtered_player_detections[frame_num]
+            )
+        ),
+        "draw_ball_bboxes": draw_pass(
+            lambda frame, frame_num: ball_tracker.draw_bboxes_on_frame(
+                frame, interpolated_ball_detections[frame_num]
+            )
+        ),
+        "draw_court_keypoints": draw_pass(
+            lambda frame, frame_num: court_line_detector.draw_keypoints(
+                frame, court_keypoints
+            )
+        ),
+        "draw_mini_court": draw_pass(
+            lambda frame, frame_num: mini_court.draw_mini_court_on_frame(frame)
+        ),
+        "draw_mini_court_players": draw_pass(
+            lambda frame, frame_num: mini_court.draw_points_on_frame(
+                frame, player_mini_court_detections[frame_num]
+            )
+        ),
+        "draw_mini_court_ball": draw_pass(
+            lambda frame, frame_num: mini_court.draw_points_on_frame(
+                frame, ball_mini_court_detections[frame_num], color=(0, 255, 255)
+            )
+        ),
+        "draw_player_stats": draw_pass(
+            lambda frame, frame_num: stats_panel.draw(
+                frame, player_stats_engine.get_frame_stats(frame_num)
+            )
+        ),
+        "save_video": (
+            lambda: os.path.join(output_dir, "benchmark_video.avi"),
+            run_save_video,
+            video_frames,
+        ),
+    }
+
+
+# Measures one stage: the wall time of every repeat with the garbage collector off, then the allocation peak of one more run under tracemalloc
+def measure_stage(setup, run, number_of_frames, repeat):
+    seconds = []
+    for _ in range(repeat):
+        inputs = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start_time = time.perf_counter()
+            run(inputs)
+            seconds.append(time.perf_counter() - start_time)
+        finally:
+            gc.enable()
+
+    inputs = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(inputs)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "frames": number_of_frames,
+        "repeat": repeat,
+        "min_seconds": min(seconds),
+        "median_seconds": median(seconds),
+        "mean_seconds": sum(seconds) / len(seconds),
+        "median_us_per_frame": median(seconds) / number_of_frames * 1e6,
+        "peak_allocated_mb": peak_bytes / 2**20,
+    }
+
+
+# Commit of the working tree, so reports can be matched to the code they measured
+def get_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def get_metadata():
+    return {
+        "commit": get_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Runs every selected stage on the stub detections and on the synthetic match-length detections, returning the report
+def run_benchmarks(
+    synthetic_frames=21600,
+    draw_frames=240,
+    video_frames=120,
+    repeat=5,
+    seed=0,
+    stage_names=None,
+):
+    player_detections, ball_detections = load_stub_detections()
+    datasets = {"stubs": (player_detections, ball_detections)}
+    if synthetic_frames:
+        datasets["synthetic"] = scale_detections(
+            player_detections, ball_detections, synthetic_frames, seed
+        )
+
+    report = {
+        "metadata": get_metadata(),
+        "config": {
+            "synthetic_frames": synthetic_frames,
+            "draw_frames": draw_frames,
+            "video_frames": video_frames,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "datasets": {},
+    }
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for dataset_name, (dataset_players, dataset_balls) in datasets.items():
+            stages = get_stages(
+                dataset_players, dataset_balls, draw_frames, video_frames, output_dir
+            )
+            results = {}
+            for stage_name, (setup, run, number_of_frames) in stages.items():
+                if stage_names and stage_name not in stage_names:
+                    continue
+                results[stage_name] = measure_stage(
+                    setup, run, number_of_frames, repeat
+                )
+                print(
+                    f"{dataset_name:>9} {stage_name:<28} "
+                    f"{results[stage_name]['median_seconds'] * 1000:10.2f} ms "
+                    f"{results[stage_name]['median_us_per_frame']:10.1f} us/frame "
+                    f"{results[stage_name]['peak_allocated_mb']:8.1f} MB",
+                    file=sys.stderr,
+                )
+            report["datasets"][dataset_name] = {
+                "frames": len(dataset_players),
+                "stages": results,
+            }
+
+    return report
+
+
+# Compares the median time of every stage with an earlier report, returning (dataset, stage, old seconds, new seconds, ratio) rows
+def compare_reports(old_report, new_report):
+    rows = []
+    for dataset_name, dataset in new_report["datasets"].items():
+        old_stages = old_report["datasets"].get(dataset_name, {}).get("stages", {})
+        for stage_name, result in dataset["stages"].items():
+            if stage_name not in old_stages:
+                continue
+            old_seconds = old_stages[stage_name]["median_seconds"]
+            new_seconds = result["median_seconds"]
+            rows.append(
+                (
+                    dataset_name,
+                    stage_name,
+                    old_seconds,
+                    new_seconds,
+                    new_seconds / old_seconds,
+                )
+            )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the non-model stages of the tennis match analysis"
+    )
+    parser.add_argument(
+        "--synthetic-frames",
+        type=int,
+        default=21600,
+        help="length of the synthetic match built from the stubs (15 minutes at 24 fps by default, 0 to skip it)",
+    )
+    parser.add_argument(
+        "--draw-frames", type=int, default=240, help="frames drawn by each draw pass"
+    )
+    parser.add_argument(
+        "--video-frames", type=int, default=120, help="frames encoded by save_video"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="timed runs of each stage"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the synthetic detections"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", default=None, help="only run these stages"
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="path of the JSON report (benchmarks/results/<commit>.json by default)",
+    )
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="earlier JSON report to compare the median times with",
+    )
+    parser.add_argument(
+        "--regression-threshold",
+        type=float,
+        default=1.1,
+        help="with --compare, exit with status 1 when a stage is this many times slower",
+    )
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        synthetic_frames=args.synthetic_frames,
+        draw_frames=args.draw_frames,
+        video_frames=args.video_frames,
+        repeat=args.repeat,
+        seed=args.seed,
+        stage_names=args.stages,
+    )
+
+    output_path = args.output
+    if output_path is None:
+        # The short hash keeps the -dirty mark, a report of uncommitted changes must not overwrite the one of their commit
+        commit = report["metadata"]["commit"] or "unknown"
+        dirty = commit.endswith("-dirty")
+        output_path = os.path.join(
+            REPO_ROOT,
+            "benchmarks",
+            "results",
+            f"{commit[:12]}{'-dirty' if dirty else ''}.json",
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output_path}", file=sys.stderr)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+
+        regressions = 0
+        for (
+            dataset_name,
+            stage_name,
+            old_seconds,
+            new_seconds,
+            ratio,
+        ) in compare_reports(old_report, report):
+            regressed = ratio > args.regression_threshold
+            regressions += regressed
+            print(
+                f"{dataset_name:>9} {stage_name:<28} {old_seconds * 1000:10.2f} ms -> "
+                f"{new_seconds * 1000:10.2f} ms  x{ratio:.2f}"
+                + ("  REGRESSION" if regressed else "")
+            )
+        sys.exit(1 if regressions else 0)
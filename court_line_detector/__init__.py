@@ -1 +1,2 @@
-from .court_line_detector import CourtLineDetector
\ No newline at end of file
+from .court_line_detector import COURT_MODEL_MODES, CourtLineDetector
+from .court_tracker import CourtTracker
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+
+
+class CourtTracker:
+    # Follows the court keypoints through a video without running the court model on every frame
+    # Every frame is compared to the last keyframe on a small grayscale thumbnail, inside the court area only, so moving players barely count
+    # The model runs again only on keyframes: camera cuts, views that drifted away from the keyframe and optional periodic refreshes
+    # Keypoints are carried forward between keyframes, periodic refreshes of an unchanged view are smoothed with the previous keypoints
+    def __init__(
+        self,
+        court_line_detector,
+        change_threshold=12.0,
+        cut_threshold=30.0,
+        refresh_interval=240,
+        smoothing=0.5,
+        thumbnail_size=(96, 54),
+    ):
+        self.court_line_detector = court_line_detector
+
+        # Mean absolute grey level difference over the court area above which the view changed since the keyframe
+        self.change_threshold = change_threshold
+        # Mean absolute grey level difference over the whole frame since the previous frame above which the camera cut
+        self.cut_threshold = cut_threshold
+        # Number of frames after which a keyframe is taken even if the view did not change, None to never refresh
+        self.refresh_interval = refresh_interval
+        # Weight of the previous keypoints when a refresh keyframe is taken on an unchanged view, 0 to not smooth
+        self.smoothing = smoothing
+        self.thumbnail_size = thumbnail_size
+
+        self.reset()
+
+    # Downscaled grayscale version of a frame used for the change checks
+    def get_thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(
+            gray, self.thumbnail_size, interpolation=cv2.INTER_AREA
+        ).astype(np.float32)
+
+    # Mask of the court area on the thumbnail: the convex hull of the keypoints scaled down from the frame
+    def get_court_mask(self, keypoints, frame_shape):
+        thumbnail_width, thumbnail_height = self.thumbnail_size
+        scale = np.array(
+            [thumbnail_width / frame_shape[1], thumbnail_height / frame_shape[0]]
+        )
+        points = np.round(keypoints.reshape(-1, 2) * scale).astype(np.int32)
+
+        mask = np.zeros((thumbnail_height, thumbnail_width), np.uint8)
+        cv2.fillConvexPoly(mask, cv2.convexHull(points), 1)
+
+        # Keypoints that make no sense give an empty area, the whole frame is compared then
+        if not mask.any():
+            mask[:] = 1
+        return mask.astype(bool)
+
+    # Forgets the current view, for a new video
+    def reset(self):
+        # Frame numbers of the keyframes of the tracked video
+        self.keyframes = []
+        self.frame_num = 0
+        self.keypoints = None
+        self.keyframe_thumbnail = None
+        self.court_mask = None
+        self.previous_thumbnail = None
+        self.last_keyframe = 0
+
+    # Returns the court keypoints of the next frame, running the court model only if it is a keyframe
+    def update(self, frame):
+        frame_num = self.frame_num
+        self.frame_num += 1
+        thumbnail = self.get_thumbnail(frame)
+
+        if self.keypoints is None:
+            is_keyframe, view_changed = True, True
+        else:
+            # A cut changes the whole frame at once, a pan or zoom moves the court area away from the keyframe
+            is_cut = (
+                np.abs(thumbnail - self.previous_thumbnail).mean() > self.cut_threshold
+            )
+            view_changed = (
+                is_cut
+                or np.abs(thumbnail - self.keyframe_thumbnail)[self.court_mask].mean()
+                > self.change_threshold
+            )
+            refresh = (
+                self.refresh_interval is not None
+                and frame_num - self.last_keyframe >= self.refresh_interval
+            )
+            is_keyframe = view_changed or refresh
+
+        if is_keyframe:
+            new_keypoints = self.court_line_detector.predict(frame)
+            if view_changed or not self.smoothing:
+                self.keypoints = new_keypoints
+            else:
+                self.keypoints = (
+                    self.smoothing * self.keypoints
+                    + (1 - self.smoothing) * new_keypoints
+                ).astype(new_keypoints.dtype)
+
+            self.keyframe_thumbnail = thumbnail
+            self.court_mask = self.get_court_mask(self.keypoints, frame.shape)
+            self.last_keyframe = frame_num
+            self.keyframes.append(frame_num)
+
+        self.previous_thumbnail = thumbnail
+        return self.keypoints
+
+    # Yields the court keypoints of every frame, frames can be a list or a generator
+    def track(self, frames):
+        self.reset()
+        for frame in frames:
+            yield self.update(frame)
+
+    # Returns the (frames, 28) court keypoints of every frame
+    def track_frames(self, frames):
+        return np.stack(list(self.track(frames)))
@@ -0,0 +1,2 @@
+from .live_source import LiveFrameReader, open_live_source
+from .live_analyzer import DROP_POLICIES, LiveAnalyzer
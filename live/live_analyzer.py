@@ -0,0 +1,344 @@
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.append("../")
+from player_stats import PlayerStatsEngine, StatsPanel
+from renderer import FrameRenderer
+from trackers import BallTrajectoryEstimator
+
+# What to do with a frame when the analysis falls behind the latency budget
+DROP_POLICIES = ("skip_detection", "lower_resolution", "drop_frames")
+
+
+class LiveAnalyzer:
+    # Analyses frames one at a time as they arrive: court keypoints, player and ball detection, mini court positions, shots and stats
+    # Every frame comes out annotated with the stats in effect at it, shots are counted change_window frames after they happen
+    # When a frame would come out more than latency_budget seconds after it was captured, the drop policy kicks in:
+    #  - skip_detection: players keep their last boxes and the ball is predicted by the trajectory estimator, the models do not run
+    #    The models still run on every max_skipped_frames-th frame in a row, so the analysis time is measured again and detection resumes once it fits
+    #  - lower_resolution: both models run at the largest of input_sizes that still fits in the budget
+    #  - drop_frames: the frame is dropped if a newer one is already waiting
+    def __init__(
+        self,
+        court_line_detector,
+        player_tracker,
+        ball_tracker,
+        mini_court,
+        court_keypoints,
+        fps=24,
+        latency_budget=0.1,
+        drop_policy="skip_detection",
+        court_tracker=None,
+        projection="keypoint",
+        input_sizes=(640, 480, 320),
+        max_skipped_frames=12,
+    ):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+
+        self.court_line_detector = court_line_detector
+        self.player_tracker = player_tracker
+        self.ball_tracker = ball_tracker
+        self.mini_court = mini_court
+        self.court_keypoints = court_keypoints
+        self.latency_budget = latency_budget
+        self.drop_policy = drop_policy
+        self.court_tracker = court_tracker
+        self.projection = projection
+        self.input_sizes = input_sizes
+        self.fps = fps
+        self.max_skipped_frames = max_skipped_frames
+
+        # Input sizes the trackers were given, lower_resolution changes them during a stream
+        self.tracker_input_sizes = [
+            (tracker, tracker.inference_params.get("imgsz"))
+            for tracker in (player_tracker, ball_tracker)
+        ]
+
+        # Ball positions come out on the frame they went in, filled and smoothed from the past frames only
+        self.ball_estimator = BallTrajectoryEstimator(max_lag=0)
+
+        # Same parameters as BallTracker.get_ball_shot_frames
+        self.rolling_window = 5
+        self.change_window = 30
+
+        # Player heights on the mini court are taken over the last player_height_window frames
+        self.player_height_window = 21
+
+        self.renderer = self.get_renderer()
+        self.reset()
+
+    # Forgets the previous stream
+    def reset(self):
+        if self.court_tracker is not None:
+            self.court_tracker.reset()
+        if self.ball_tracker.search_window is not None:
+            self.ball_tracker.search_window.reset()
+        self.ball_estimator.reset()
+        self.player_stats_engine = PlayerStatsEngine(
+            self.mini_court.get_width_of_mini_court(), fps=self.fps
+        )
+        self.stats_panel = StatsPanel()
+        for tracker, input_size in self.tracker_input_sizes:
+            if input_size is None:
+                tracker.inference_params.pop("imgsz", None)
+            else:
+                tracker.inference_params["imgsz"] = input_size
+
+        self.chosen_players = None
+        self.last_player_dict = {}
+        self.input_size_index = 0
+        self.skipped_in_a_row = 0
+
+        # Player and ball boxes of the last frames for the mini court player heights
+        self.player_history = deque(maxlen=self.player_height_window)
+        self.ball_history = deque(maxlen=self.player_height_window)
+
+        # Ball boxes, and (frame_num, mini court player positions, mini court ball position) of the frames shots can still be found on
+        shot_window = self.rolling_window + self.change_window + 1
+        self.shot_ball_history = deque(maxlen=shot_window)
+        self.shot_position_history = deque(maxlen=shot_window)
+
+        # Everything the overlays draw for the current frame
+        self.current = {}
+
+        # Seconds spent analysing a frame going through the models, averaged over the last ones, per model input size
+        self.analysis_times = {}
+        self.frame_reader = None
+        self.latencies = []
+        self.dropped_frames = 0
+        self.skipped_detections = 0
+        self.reduced_resolution_frames = 0
+
+    # Overlays drawing the current frame's analysis
+    def get_renderer(self):
+        renderer = FrameRenderer()
+        renderer.add_overlay(
+            "player_bboxes",
+            lambda frame, frame_num: self.player_tracker.draw_bboxes_on_frame(
+                frame, self.current["player_dict"]
+            ),
+        )
+        renderer.add_overlay(
+            "ball_bboxes",
+            lambda frame, frame_num: self.ball_tracker.draw_bboxes_on_frame(
+                frame, self.current["ball_dict"]
+            ),
+        )
+        renderer.add_overlay(
+            "court_keypoints",
+            lambda frame, frame_num: self.court_line_detector.draw_keypoints(
+                frame, self.current["court_keypoints"]
+            ),
+        )
+        renderer.add_overlay(
+            "mini_court",
+            lambda frame, frame_num: self.mini_court.draw_mini_court_on_frame(frame),
+        )
+        renderer.add_overlay(
+            "mini_court_players",
+            lambda frame, frame_num: self.mini_court.draw_points_on_frame(
+                frame, self.current["player_mini_court_positions"]
+            ),
+        )
+        renderer.add_overlay(
+            "mini_court_ball",
+            lambda frame, frame_num: self.mini_court.draw_points_on_frame(
+                frame, self.current["ball_mini_court_position"], color=(0, 255, 255)
+            ),
+        )
+        renderer.add_overlay(
+            "player_stats",
+            lambda frame, frame_num: self.stats_panel.draw(
+                frame, self.current["stats"]
+            ),
+        )
+        return renderer
+
+    # Analyses the frames of a LiveFrameReader as they arrive, yielding each (frame_num, annotated frame, stats) as soon as it is ready
+    def run(self, frame_reader):
+        self.reset()
+        self.frame_reader = frame_reader
+        for frame_num, capture_time, frame in frame_reader:
+            waited = time.perf_counter() - capture_time
+
+            if self.drop_policy == "lower_resolution":
+                self.set_input_size(waited)
+
+            # Latency the frame would come out with: time waited so far plus the usual analysis time of a frame going through the models
+            input_size = self.input_sizes[self.input_size_index]
+            behind = waited + self.get_analysis_time(input_size) > self.latency_budget
+
+            if behind and self.drop_policy == "drop_frames" and frame_reader.pending():
+                self.dropped_frames += 1
+                continue
+
+            # A frame whose detection is forced after max_skipped_frames skipped ones measures the analysis time afresh
+            skip = behind and self.drop_policy == "skip_detection"
+            probe = skip and self.skipped_in_a_row + 1 >= self.max_skipped_frames
+            detect = not skip or probe
+            self.skipped_in_a_row = 0 if detect else self.skipped_in_a_row + 1
+
+            start_time = time.perf_counter()
+            stats = self.analyse_frame(frame_num, frame, detect)
+            frame = self.renderer.render_frame(frame, frame_num)
+            end_time = time.perf_counter()
+
+            # A probe replaces the average, which one slow call could otherwise keep over the budget for good
+            if detect:
+                analysis_time = end_time - start_time
+                self.analysis_times[input_size] = (
+                    0.9 * self.analysis_times[input_size] + 0.1 * analysis_time
+                    if input_size in self.analysis_times and not probe
+                    else analysis_time
+                )
+            self.latencies.append(end_time - capture_time)
+            yield frame_num, frame, stats
+
+    # Usual analysis time of a frame going through the models at an input size
+    # Sizes not measured yet are estimated from a measured one, the model cost growing with the input area
+    def get_analysis_time(self, input_size):
+        if input_size in self.analysis_times:
+            return self.analysis_times[input_size]
+        for measured_size, analysis_time in self.analysis_times.items():
+            return analysis_time * (input_size / measured_size) ** 2
+        return 0.0
+
+    # Picks the largest model input size whose usual analysis time still fits in what is left of the budget
+    def set_input_size(self, waited):
+        self.input_size_index = len(self.input_sizes) - 1
+        for index, input_size in enumerate(self.input_sizes):
+            if waited + self.get_analysis_time(input_size) <= self.latency_budget:
+                self.input_size_index = index
+                break
+
+        input_size = self.input_sizes[self.input_size_index]
+        self.player_tracker.inference_params["imgsz"] = input_size
+        self.ball_tracker.inference_params["imgsz"] = input_size
+        if self.input_size_index > 0:
+            self.reduced_resolution_frames += 1
+
+    # Runs the whole analysis on one frame and returns the stats in effect at it
+    def analyse_frame(self, frame_num, frame, detect=True):
+        if self.court_tracker is not None:
+            self.court_keypoints = self.court_tracker.update(frame)
+
+        if detect:
+            player_dict = self.player_tracker.detect_batch([frame])[0]
+            ball_dict = self.ball_tracker.detect_batch([frame])[0]
+        else:
+            player_dict = self.last_player_dict
+            ball_dict = {}
+            if self.ball_tracker.search_window is not None:
+                self.ball_tracker.search_window.update(ball_dict)
+            self.skipped_detections += 1
+        self.last_player_dict = player_dict
+
+        # The two players are chosen on the first frame with at least two people on it
+        if self.chosen_players is None and len(player_dict) >= 2:
+            self.chosen_players = self.player_tracker.choose_players(
+                self.court_keypoints, player_dict
+            )
+        player_dict = {
+            track_id: bbox
+            for track_id, bbox in player_dict.items()
+            if self.chosen_players is not None and track_id in self.chosen_players
+        }
+
+        [(ball_dict, _)] = self.ball_estimator.update(ball_dict)
+
+        player_mini_court_positions, ball_mini_court_position = (
+            self.get_mini_court_positions(player_dict, ball_dict)
+        )
+        self.add_shots(
+            frame_num, ball_dict, player_mini_court_positions, ball_mini_court_position
+        )
+
+        stats = self.player_stats_engine.get_frame_stats(frame_num)
+        self.current = {
+            "player_dict": player_dict,
+            "ball_dict": ball_dict,
+            "court_keypoints": self.court_keypoints,
+            "player_mini_court_positions": player_mini_court_positions,
+            "ball_mini_court_position": ball_mini_court_position,
+            "stats": stats,
+        }
+        return stats
+
+    # Mini court positions of the current frame, the player heights come from the last frames only
+    def get_mini_court_positions(self, player_dict, ball_dict):
+        self.player_history.append(player_dict)
+        self.ball_history.append(ball_dict)
+        if not any(self.player_history):
+            return {}, {}
+
+        player_mini_court_detections, ball_mini_court_detections = (
+            self.mini_court.convert_bounding_boxes_to_mini_court_coordinates(
+                list(self.player_history),
+                list(self.ball_history),
+                self.court_keypoints,
+                projection=self.projection,
+            )
+        )
+        return player_mini_court_detections[-1], ball_mini_court_detections[-1]
+
+    # Looks for a shot on the last frame that has change_window frames after it, and counts it in the stats
+    # The shot search runs on the last frames only, from far enough back that the rolling mean is the one of the whole stream
+    def add_shots(
+        self,
+        frame_num,
+        ball_dict,
+        player_mini_court_positions,
+        ball_mini_court_position,
+    ):
+        self.shot_ball_history.append(ball_dict)
+        self.shot_position_history.append(
+            (frame_num, player_mini_court_positions, ball_mini_court_position)
+        )
+
+        candidate = len(self.shot_ball_history) - self.change_window - 1
+        if candidate < 1:
+            return
+
+        ball_shot_frames = self.ball_tracker.get_ball_shot_frames(
+            list(self.shot_ball_history),
+            change_window=self.change_window,
+            rolling_window=self.rolling_window,
+        )
+        if candidate not in ball_shot_frames:
+            return
+
+        # Shots without both players and the ball on the mini court cannot be measured, the previous shot is not measured across them either
+        shot_frame_num, player_positions, ball_position = self.shot_position_history[
+            candidate
+        ]
+        if len(player_positions) == 2 and 1 in ball_position:
+            self.player_stats_engine.add_shot_frame(
+                shot_frame_num, player_positions, ball_position[1]
+            )
+        else:
+            self.player_stats_engine.skip_shot_frame()
+
+    # Returns the end-to-end latencies and the counts of frames the drop policy acted on
+    def get_latency_report(self):
+        latencies = np.array(self.latencies)
+
+        report = {
+            "drop_policy": self.drop_policy,
+            "latency_budget_ms": self.latency_budget * 1000,
+            "frames": len(self.latencies),
+            "dropped_frames": self.dropped_frames,
+            "buffer_overflow_frames": (
+                self.frame_reader.dropped_frames if self.frame_reader else 0
+            ),
+            "skipped_detections": self.skipped_detections,
+            "reduced_resolution_frames": self.reduced_resolution_frames,
+        }
+        if self.latencies:
+            report["mean_latency_ms"] = float(latencies.mean() * 1000)
+            report["p95_latency_ms"] = float(np.percentile(latencies, 95) * 1000)
+            report["over_budget_frames"] = int((latencies > self.latency_budget).sum())
+        return report
@@ -0,0 +1,155 @@
+import os
+import stat
+import sys
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+# Reads raw BGR frames of a known size from a binary stream (a pipe, stdin or a FIFO) until it ends
+# Each frame gets its own buffer so it can be drawn on in place
+def iter_raw_frames(stream, frame_size):
+    width, height = frame_size
+    frame_bytes = width * height * 3
+
+    while True:
+        buffer = bytearray(frame_bytes)
+        view = memoryview(buffer)
+        bytes_read = 0
+        while bytes_read < frame_bytes:
+            chunk_size = stream.readinto(view[bytes_read:])
+            if not chunk_size:
+                return
+            bytes_read += chunk_size
+        yield np.frombuffer(buffer, np.uint8).reshape(height, width, 3)
+
+
+# Reads a video file that is still being written, waiting for new frames at its end
+# The file is reopened at the next frame every poll_interval seconds, the stream ends after idle_timeout seconds without a new frame
+# The container must be readable while it grows (MPEG-TS, fragmented MP4, MJPEG AVI...)
+def iter_growing_video_frames(video_path, poll_interval=0.05, idle_timeout=5.0):
+    frame_num = 0
+    last_frame_time = time.perf_counter()
+
+    while time.perf_counter() - last_frame_time < idle_timeout:
+        cap = cv2.VideoCapture(video_path)
+        if frame_num > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame
+                frame_num += 1
+                last_frame_time = time.perf_counter()
+        finally:
+            cap.release()
+        time.sleep(poll_interval)
+
+
+# Reads a capture device until it stops giving frames
+def iter_capture_frames(cap):
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+
+# Opens a live source and returns its frames (a generator) and its frame rate
+# The source is a capture device index, "-" for raw BGR frames on stdin, the path of a FIFO carrying raw BGR frames, or the path of a growing video file
+# Raw frames need their (width, height), their frame rate is fps (24 when not given), devices and files report their own
+def open_live_source(source, frame_size=None, fps=None):
+    if isinstance(source, int) or str(source).isdigit():
+        cap = cv2.VideoCapture(int(source))
+        if not cap.isOpened():
+            raise ValueError(f"Could not open capture device {source}")
+        return iter_capture_frames(cap), fps or cap.get(cv2.CAP_PROP_FPS) or 24
+
+    if source == "-" or stat.S_ISFIFO(os.stat(source).st_mode):
+        if frame_size is None:
+            raise ValueError("Raw frames from a pipe need a frame size")
+        stream = sys.stdin.buffer if source == "-" else open(source, "rb")
+        return iter_raw_frames(stream, frame_size), fps or 24
+
+    cap = cv2.VideoCapture(source)
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return iter_growing_video_frames(source), fps or source_fps or 24
+
+
+class LiveFrameReader:
+    # Reads the frames of a live source on a background thread and timestamps them as they arrive, so the time a frame waited before being analysed is known
+    # At most max_buffered_frames wait at once, the oldest waiting frame is dropped when a new one arrives on a full buffer
+    def __init__(self, frames, max_buffered_frames=64):
+        self.frames = frames
+        self.max_buffered_frames = max_buffered_frames
+
+        # (frame_num, capture_time, frame) of the frames waiting, oldest first
+        self.buffered_frames = deque()
+        self.condition = threading.Condition()
+        self.finished = False
+        self.error = None
+        self.thread = None
+
+        # Number of frames dropped because the buffer was full
+        self.dropped_frames = 0
+
+    # Number of frames waiting to be analysed
+    def pending(self):
+        with self.condition:
+            return len(self.buffered_frames)
+
+    def _read(self):
+        try:
+            for frame_num, frame in enumerate(self.frames):
+                capture_time = time.perf_counter()
+                with self.condition:
+                    if len(self.buffered_frames) == self.max_buffered_frames:
+                        self.buffered_frames.popleft()
+                        self.dropped_frames += 1
+                    self.buffered_frames.append((frame_num, capture_time, frame))
+                    self.condition.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+
+    # Starts the reading thread, once
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._read, daemon=True)
+            self.thread.start()
+
+    # Waits for the first frame and returns it without taking it off the buffer, None if the source has no frames
+    def peek_first_frame(self):
+        self.start()
+        with self.condition:
+            while not self.buffered_frames and not self.finished:
+                self.condition.wait()
+            return self.buffered_frames[0][2] if self.buffered_frames else None
+
+    # Yields (frame_num, capture_time, frame) as frames arrive, frame_num being the position of the frame in the source
+    def __iter__(self):
+        self.start()
+
+        while True:
+            with self.condition:
+                while not self.buffered_frames and not self.finished:
+                    self.condition.wait()
+                if not self.buffered_frames:
+                    break
+                item = self.buffered_frames.popleft()
+            yield item
+
+        if self.error is not None:
+            raise self.error
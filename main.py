@@ -1,387 +1,729 @@
-from copy import deepcopy
+import argparse
+import json
+import os
+from itertools import islice
 
-import cv2
-import pandas as pd
-
-import constants
-from court_line_detector import CourtLineDetector
+from court_line_detector import COURT_MODEL_MODES, CourtLineDetector, CourtTracker
+from live import DROP_POLICIES, LiveAnalyzer, LiveFrameReader, open_live_source
 from mini_court import MiniCourt
-from trackers import BallTracker, PlayerTracker
+from pipeline import PipelineMetrics, ThreadedPipeline, detect_frames_in_parallel
+from player_stats import PlayerStatsEngine, StatsPanel
+from renderer import FrameRenderer
+from trackers import BallSearchWindow, BallTracker, DetectionCache, PlayerTracker
 from utils import (
-    convert_pixel_distance_to_meters,
-    measure_distance,
-    read_video,
+    get_court_roi,
+    get_video_frame_count,
+    get_video_properties,
+    iter_frame_batches,
+    iter_video_frames,
+    read_first_frame,
     save_video,
 )
 
-
-def main():
-    # Split video into frames
-    input_video_path = "input_videos/input_video.mp4"
-    video_frames = read_video(input_video_path)
+# Match video analysed by default, the only one the tracker stubs belong to
+DEFAULT_INPUT_VIDEO_PATH = "input_videos/input_video.mp4"
+
+# File extension of the tracker stubs of each stub format: pickled lists, or columnar Detections in an .npz archive or a directory of memory-mapped .npy files
+STUB_EXTENSIONS = {"pkl": ".pkl", "npz": ".npz", "npy": ""}
+
+
+# Runs both trackers on batches of frames and yields the player and ball detections of each frame
+def detect_players_and_ball(frames, player_tracker, ball_tracker, batch_size):
+    for batch in iter_frame_batches(frames, batch_size):
+        player_dicts = player_tracker.detect_batch(batch)
+        ball_dicts = ball_tracker.detect_batch(batch)
+        yield from zip(player_dicts, ball_dicts)
+
+
+def main(
+    input_video_path=DEFAULT_INPUT_VIDEO_PATH,
+    pipelined=False,
+    read_from_stub=True,
+    batch_size=8,
+    queue_size=16,
+    workers=1,
+    detection_cache_path=None,
+    cache_size_mb=512,
+    projection="keypoint",
+    court_tracking=False,
+    court_model_mode="eager",
+    ball_search_window=None,
+    player_stride=1,
+    court_roi=False,
+    ball_estimator="interpolate",
+    output_video_path="output_videos/output_video.mp4",
+    codec="MJPG",
+    metrics_path=None,
+    latency_histograms=False,
+    profile_path=None,
+    trace_allocations=False,
+    models=None,
+    stub_dir="tracker_stubs",
+    stub_format="pkl",
+    warm_up=False,
+):
+    # Detections are read from, or saved to, the stubs of stub_dir in stub_format (see STUB_EXTENSIONS), None to neither read nor save them
+    # Models are only loaded if they run, with warm_up the ones that will run are loaded and run once on the first frame in a phase of their own
+    # models can hold already loaded models to reuse ("court_line_detector", "player_model" and "ball_model"), the models missing from it are loaded here
+    if models is None:
+        models = {}
+
+    # Instrumentation: wall time, frames per second and memory of every phase and stage, written to metrics_path at the end
+    metrics = PipelineMetrics(
+        latency_histograms=latency_histograms,
+        trace_allocations=trace_allocations,
+        profile_path=profile_path,
+    ).start()
+    metrics.start_phase("setup")
+
+    # Frames are streamed from the video file one at a time, only the first frame is kept around
+    first_frame = read_first_frame(input_video_path)
+
+    ## Reads the frames of the video, the time spent decoding them counts towards the decode stage
+    def read_frames():
+        return metrics.time_iterator("decode", iter_video_frames(input_video_path))
+
+    # Speeds and the output video use the frame rate of the source, 24 fps if its container does not report one
+    fps, frame_size = get_video_properties(input_video_path)
+    fps = fps or 24
+
+    ## Loads a model and runs it once on the first frame, its cold start is counted in the model_warm_up phase instead of the phase it is needed in
+    def warm_up_model(model, phase):
+        metrics.start_phase("model_warm_up")
+        model.warm_up(first_frame)
+        metrics.start_phase(phase)
 
     # Detection
     ## Detecting court line keypoints
+    metrics.start_phase("court_keypoints")
     court_model_path = "models/keypoints_model.pth"
-    court_line_detector = CourtLineDetector(court_model_path)
-    court_keypoints = court_line_detector.predict(video_frames[0])
-
-    ## Detecting players
-    player_tracker = PlayerTracker(model_path="yolo11x")
-    player_detections = player_tracker.detect_frames(
-        video_frames,
-        read_from_stub=True,
-        stub_path="tracker_stubs/player_detections.pkl",
-    )
-
-    ### Choose only players
-    player_detections = player_tracker.choose_and_filter_players(
-        court_keypoints, player_detections
-    )
-
-    ## Detecting ball
-    ball_tracker = BallTracker(model_path="models/yolo11x_last.pt")
-    ball_detections = ball_tracker.detect_frames(
-        video_frames, read_from_stub=True, stub_path="tracker_stubs/ball_detections.pkl"
+    court_line_detector = models.get("court_line_detector") or CourtLineDetector(
+        court_model_path, mode=court_model_mode
     )
-    ball_detections = ball_tracker.interpolate_ball_positions(ball_detections)
-
-    ## Detect ball shots
-    ball_shot_frames = ball_tracker.get_ball_shot_frames(ball_detections)
-
-    # Drawing Bounding Boxes
-    ## Draw Player Bounding Boxes
-    output_video_frames = player_tracker.draw_bboxes(video_frames, player_detections)
-
-    ## Draw Ball Bounding Boxes
-    output_video_frames = ball_tracker.draw_bboxes(output_video_frames, ball_detections)
 
-    ## Draw Court keypoints
-    output_video_frames = court_line_detector.draw_keypoints_on_video(
-        output_video_frames, court_keypoints
+    ### A detection cache also keeps the first frame's keypoints, keyed on the video content, the model weights and the inference mode
+    detection_cache = (
+        DetectionCache(detection_cache_path, max_size_bytes=cache_size_mb << 20)
+        if detection_cache_path is not None
+        else None
     )
-
-    # Mini court
-    ## Initialize mini court
-    mini_court = MiniCourt(video_frames[0])
-
-    ## Convert player positions to mini court positions
-    player_mini_court_detections, ball_mini_court_detections = (
-        mini_court.convert_bounding_boxes_to_mini_court_coordinates(
-            player_detections, ball_detections, court_keypoints
+    court_cache_key = None
+    cached_court_keypoints = None
+    if detection_cache is not None and not court_tracking:
+        court_cache_key = detection_cache.get_key(
+            input_video_path,
+            court_model_path,
+            {"mode": court_line_detector.mode, "frames": "first"},
         )
+        cached_court_keypoints = detection_cache.get_detections(court_cache_key).get(0)
+
+    if warm_up and cached_court_keypoints is None:
+        warm_up_model(court_line_detector, "court_keypoints")
+    metrics.instrument(court_line_detector, "predict_batch", "court_model", model=True)
+
+    if court_tracking:
+        ### Keypoints of every frame, the court model only runs again on frames where the camera view changed
+        court_tracker = CourtTracker(court_line_detector)
+        court_keypoints = court_tracker.track_frames(read_frames())
+        first_court_keypoints = court_keypoints[0]
+    elif cached_court_keypoints is not None:
+        ### Keypoints of the first frame found in the detection cache, used for the whole video
+        court_keypoints = cached_court_keypoints
+        first_court_keypoints = court_keypoints
+    else:
+        ### Keypoints of the first frame, used for the whole video
+        court_keypoints = court_line_detector.predict(first_frame)
+        first_court_keypoints = court_keypoints
+        if court_cache_key is not None:
+            detection_cache.put_detections(court_cache_key, {0: court_keypoints})
+
+    ## Returns the court keypoints in effect at a frame
+    def get_frame_court_keypoints(frame_num):
+        return court_keypoints[frame_num] if court_tracking else court_keypoints
+
+    ## Detecting players and ball
+    metrics.start_phase("player_and_ball_detection")
+
+    ### With court_roi the models only see the padded box around the court keypoints
+    roi = get_court_roi(court_keypoints, first_frame.shape) if court_roi else None
+
+    player_tracker = PlayerTracker(
+        model_path="yolo11x",
+        max_stride=player_stride,
+        roi=roi,
+        model=models.get("player_model"),
     )
-
-    ## Draw mini court
-    output_video_frames = mini_court.draw_mini_court(output_video_frames)
-
-    ## Draw player postitions on mini court
-    output_video_frames = mini_court.draw_points_on_mini_court(
-        output_video_frames, player_mini_court_detections
+    ball_tracker = BallTracker(
+        model_path="models/yolo11x_last.pt",
+        search_window=(
+            BallSearchWindow(window_size=ball_search_window)
+            if ball_search_window
+            else None
+        ),
+        roi=roi,
+        model=models.get("ball_model"),
     )
 
-    ## Draw ball postition on mini court
-    output_video_frames = mini_court.draw_points_on_mini_court(
-        output_video_frames, ball_mini_court_detections, color=(0, 255, 255)
-    )
-
-    # Player stats
-
-    ## List to store statistical data related to player performance
-    player_stats_data = [
-        {
-            "frame_num": 0,
-            "player_1_number_of_shots": 0,
-            "player_1_total_shot_speed": 0,
-            "player_1_last_shot_speed": 0,
-            "player_1_total_player_speed": 0,
-            "player_1_last_player_speed": 0,
-            "player_2_number_of_shots": 0,
-            "player_2_total_shot_speed": 0,
-            "player_2_last_shot_speed": 0,
-            "player_2_total_player_speed": 0,
-            "player_2_last_player_speed": 0,
-        }
-    ]
-
-    ## Calculates various statistics related to the shot and the players on each ball hit
-    for ball_shot_index in range(len(ball_shot_frames) - 1):
-        # Get start and end frames for the current ball shot
-        start_frame = ball_shot_frames[ball_shot_index]
-        end_frame = ball_shot_frames[ball_shot_index + 1]
-
-        # Calculate the time duration of the ball shot in seconds (assuming 24fps)
-        ball_shot_time_in_seconds = (end_frame - start_frame) / 24
-
-        # Measure and convert the pixel distance covered by the ball to meters
-        distance_covered_by_ball_pixels = measure_distance(
-            ball_mini_court_detections[start_frame][1],
-            ball_mini_court_detections[end_frame][1],
+    ### Returns whether a tracker's model will run: not with stubs, nor when the detection cache holds every frame
+    def needs_detection(tracker):
+        if read_from_stub:
+            return False
+        if detection_cache is None:
+            return True
+        cache_key = detection_cache.get_key(
+            input_video_path, tracker.model_path, tracker.get_cache_params()
         )
-
-        distance_covered_by_ball_meters = convert_pixel_distance_to_meters(
-            distance_covered_by_ball_pixels,
-            constants.DOUBLE_LINE_WIDTH,
-            mini_court.get_width_of_mini_court(),
+        return detection_cache.count_frames(cache_key) < get_video_frame_count(
+            input_video_path
         )
 
-        # Calculate the speed of the ball shot in kilometers per hour (km/h)
-        speed_of_ball_shot = (
-            distance_covered_by_ball_meters / ball_shot_time_in_seconds * 3.6
+    ### Segment workers load their own models, the ones here do not run
+    if warm_up and workers <= 1:
+        for tracker in (player_tracker, ball_tracker):
+            if needs_detection(tracker):
+                warm_up_model(tracker, "player_and_ball_detection")
+    metrics.instrument(player_tracker, "detect_batch", "player_detection", model=True)
+    metrics.instrument(ball_tracker, "detect_batch", "ball_detection", model=True)
+
+    if workers > 1 and not read_from_stub:
+        ### Overlapping segments of the video are analysed in parallel worker processes and stitched back together
+        player_detections, ball_detections = detect_frames_in_parallel(
+            input_video_path,
+            player_model_path="yolo11x",
+            ball_model_path="models/yolo11x_last.pt",
+            number_of_workers=workers,
+            batch_size=batch_size,
+            ball_search_window=ball_search_window,
+            player_stride=player_stride,
+            roi=roi,
         )
-
-        # Identify which player shot the ball based on their position at the start frame
-        player_positions = player_mini_court_detections[start_frame]
-
-        player_shot_ball = min(
-            player_positions.keys(),
-            key=lambda player_id: measure_distance(
-                player_positions[player_id], ball_mini_court_detections[start_frame][1]
+    elif pipelined and not read_from_stub:
+        ### Decoding runs on its own thread while both trackers work on the previous frames
+        detection_pipeline = ThreadedPipeline(
+            read_frames(), max_queue_size=queue_size
+        ).add_stage(
+            "inference",
+            lambda frames: detect_players_and_ball(
+                frames, player_tracker, ball_tracker, batch_size
             ),
         )
 
-        # Determine the opponent player ID based on who shot the ball
-        opponent_player_id = 1 if player_shot_ball == 2 else 2
-
-        # Measure and convert the pixel distance covered by the opponent to meters
-        distance_covered_by_opponent_pixels = measure_distance(
-            player_mini_court_detections[start_frame][opponent_player_id],
-            player_mini_court_detections[end_frame][opponent_player_id],
+        player_detections = []
+        ball_detections = []
+        for player_dict, ball_dict in detection_pipeline:
+            player_detections.append(player_dict)
+            ball_detections.append(ball_dict)
+    else:
+        ### With a detection cache only the frames not analysed by a previous run go through the models
+        player_detections = player_tracker.detect_frames(
+            read_frames(),
+            read_from_stub=read_from_stub,
+            stub_path=(
+                os.path.join(
+                    stub_dir, "player_detections" + STUB_EXTENSIONS[stub_format]
+                )
+                if stub_dir
+                else None
+            ),
+            batch_size=batch_size,
+            cache=detection_cache,
+            video_path=input_video_path,
         )
 
-        distance_covered_by_opponent_meters = convert_pixel_distance_to_meters(
-            distance_covered_by_opponent_pixels,
-            constants.DOUBLE_LINE_WIDTH,
-            mini_court.get_width_of_mini_court(),
+        ball_detections = ball_tracker.detect_frames(
+            read_frames(),
+            read_from_stub=read_from_stub,
+            stub_path=(
+                os.path.join(stub_dir, "ball_detections" + STUB_EXTENSIONS[stub_format])
+                if stub_dir
+                else None
+            ),
+            batch_size=batch_size,
+            cache=detection_cache,
+            video_path=input_video_path,
         )
 
-        # Calculate the speed of the opponent in kilometers per hour (km/h)
-        speed_of_opponent = (
-            distance_covered_by_opponent_meters / ball_shot_time_in_seconds * 3.6
-        )
+    if detection_cache is not None:
+        detection_cache.close()
 
-        # Create a copy of the current player statistics
-        current_player_stats = deepcopy(player_stats_data[-1])
+    ### Choose only players
+    player_detections = player_tracker.choose_and_filter_players(
+        first_court_keypoints, player_detections
+    )
 
-        # Update the frame number for these stats
-        current_player_stats["frame_num"] = start_frame
+    metrics.start_phase("ball_positions_and_shots")
 
-        # Increment the count and update the total shot speed for the player who shot the ball
-        current_player_stats[f"player_{player_shot_ball}_number_of_shots"] += 1
+    ## Fill in missing ball positions, by linear interpolation or with the Kalman trajectory estimator
+    if ball_estimator == "kalman":
+        ball_detections = ball_tracker.estimate_ball_positions(ball_detections)
+    else:
+        ball_detections = ball_tracker.interpolate_ball_positions(ball_detections)
 
-        current_player_stats[f"player_{player_shot_ball}_total_shot_speed"] += (
-            speed_of_ball_shot
-        )
+    ## Detect ball shots
+    ball_shot_frames = ball_tracker.get_ball_shot_frames(ball_detections)
 
-        current_player_stats[f"player_{player_shot_ball}_last_shot_speed"] = (
-            speed_of_ball_shot
-        )
+    # Mini court
+    ## Initialize mini court
+    metrics.start_phase("mini_court")
+    mini_court = MiniCourt(first_frame)
+    metrics.instrument(
+        mini_court, "convert_bounding_boxes_to_mini_court_coordinates", "mini_court"
+    )
 
-        # Update the total and last player speed for the opponent
-        current_player_stats[f"player_{opponent_player_id}_total_player_speed"] += (
-            speed_of_opponent
+    ## Convert player positions to mini court positions
+    player_mini_court_detections, ball_mini_court_detections = (
+        mini_court.convert_bounding_boxes_to_mini_court_coordinates(
+            player_detections, ball_detections, court_keypoints, projection=projection
         )
+    )
 
-        current_player_stats[f"player_{opponent_player_id}_last_player_speed"] = (
-            speed_of_opponent
-        )
+    # Player stats
+    metrics.start_phase("player_stats")
 
-        player_stats_data.append(current_player_stats)
+    ## Running per-player counters updated on every shot, the stats of a frame are looked up from the last shot before it
+    player_stats_engine = PlayerStatsEngine(
+        mini_court.get_width_of_mini_court(), fps=fps
+    )
+    player_stats_engine.add_shots(
+        ball_shot_frames, player_mini_court_detections, ball_mini_court_detections
+    )
 
-    ## Convert the list of dictionaries containing player statistics data into a DataFrame
-    player_stats_data_df = pd.DataFrame(player_stats_data)
+    ## Draw player stats of one frame in place, the panel is only re-rasterised when the values change
+    stats_panel = StatsPanel()
 
-    ## Create a DataFrame with frame numbers ranging from 0 to the length of video_frames minus one
-    frames_df = pd.DataFrame({"frame_num": list(range(len(video_frames)))})
+    def draw_player_stats(frame, frame_num):
+        return stats_panel.draw(frame, player_stats_engine.get_frame_stats(frame_num))
 
-    ## Merge frames_df and player_stats_data_df on the "frame_num" column using an outer join (how="left")
-    player_stats_data_df = pd.merge(
-        frames_df, player_stats_data_df, on="frame_num", how="left"
-    )
+    # Drawing
+    metrics.start_phase("render_and_encode")
 
-    ## Forward fill any missing values in the merged DataFrame
-    player_stats_data_df = player_stats_data_df.ffill()
+    ## Every overlay draws on the frame in place, each frame is annotated once in a single pass
+    renderer = FrameRenderer()
 
-    ## Calculate average shot speed for Player 1
-    player_stats_data_df["player_1_average_shot_speed"] = (
-        player_stats_data_df["player_1_total_shot_speed"]
-        / player_stats_data_df["player_1_number_of_shots"]
+    ## Draw Player Bounding Boxes
+    renderer.add_overlay(
+        "player_bboxes",
+        lambda frame, frame_num: player_tracker.draw_bboxes_on_frame(
+            frame, player_detections[frame_num]
+        ),
     )
 
-    ## Calculate average shot speed for Player 2
-    player_stats_data_df["player_2_average_shot_speed"] = (
-        player_stats_data_df["player_2_total_shot_speed"]
-        / player_stats_data_df["player_2_number_of_shots"]
+    ## Draw Ball Bounding Boxes
+    renderer.add_overlay(
+        "ball_bboxes",
+        lambda frame, frame_num: ball_tracker.draw_bboxes_on_frame(
+            frame, ball_detections[frame_num]
+        ),
     )
 
-    ## Calculate average player speed for Player 1
-    player_stats_data_df["player_1_average_player_speed"] = (
-        player_stats_data_df["player_1_total_player_speed"]
-        / player_stats_data_df["player_2_number_of_shots"]
+    ## Draw Court keypoints
+    renderer.add_overlay(
+        "court_keypoints",
+        lambda frame, frame_num: court_line_detector.draw_keypoints(
+            frame, get_frame_court_keypoints(frame_num)
+        ),
     )
 
-    ## Calculate average player speed for Player 2
-    player_stats_data_df["player_2_average_player_speed"] = (
-        player_stats_data_df["player_2_total_player_speed"]
-        / player_stats_data_df["player_1_number_of_shots"]
+    ## Draw mini court
+    renderer.add_overlay(
+        "mini_court",
+        lambda frame, frame_num: mini_court.draw_mini_court_on_frame(frame),
     )
 
-    ## Draw player stats
-    def draw_player_stats(output_video_frames, player_stats):
-        # Loop through each row in the player_stats DataFrame
-        for index, row in player_stats.iterrows():
-            # Extract shot speed and player speed data from current row
-            player_1_shot_speed = row["player_1_last_shot_speed"]
-            player_2_shot_speed = row["player_2_last_shot_speed"]
-            player_1_speed = row["player_1_last_player_speed"]
-            player_2_speed = row["player_2_last_player_speed"]
-
-            # Extract average shot speed and player speed data from current row
-            avg_player_1_shot_speed = row["player_1_average_shot_speed"]
-            avg_player_2_shot_speed = row["player_2_average_shot_speed"]
-            avg_player_1_speed = row["player_1_average_player_speed"]
-            avg_player_2_speed = row["player_2_average_player_speed"]
-
-            # Get the current frame from output_video_frames
-            frame = output_video_frames[index]
-
-            # Define dimensions of the overlay rectangle
-            width = 350
-            height = 230
+    ## Draw player postitions on mini court
+    renderer.add_overlay(
+        "mini_court_players",
+        lambda frame, frame_num: mini_court.draw_points_on_frame(
+            frame, player_mini_court_detections[frame_num]
+        ),
+    )
 
-            # Calculate the start and end coordinates for the overlay rectangle
-            start_x = frame.shape[1] - 400
-            start_y = frame.shape[0] - 500
-            end_x = start_x + width
-            end_y = start_y + height
+    ## Draw ball postition on mini court
+    renderer.add_overlay(
+        "mini_court_ball",
+        lambda frame, frame_num: mini_court.draw_points_on_frame(
+            frame, ball_mini_court_detections[frame_num], color=(0, 255, 255)
+        ),
+    )
 
-            # Create a copy of the current frame to draw on
-            overlay = frame.copy()
+    ## Draw Player Stats
+    renderer.add_overlay("player_stats", draw_player_stats)
+
+    ## Each overlay counts as its own draw stage
+    metrics.instrument_renderer(renderer)
+
+    ## Like zipping the frames with the detections, rendering stops at the last detected frame if the video goes on (stubs of another video, a miscounted split)
+    number_of_frames = min(len(player_detections), len(ball_detections))
+    if court_tracking:
+        number_of_frames = min(number_of_frames, len(court_keypoints))
+
+    def read_detected_frames():
+        return islice(read_frames(), number_of_frames)
+
+    if pipelined:
+        ## Decoding and annotation run on their own threads while the writer thread encodes
+        output_video_frames = ThreadedPipeline(
+            read_detected_frames(), max_queue_size=queue_size
+        ).add_stage("annotate", renderer.render)
+    else:
+        output_video_frames = renderer.render(read_detected_frames())
+
+    # Combines frames to video, encoding on a background thread at the source frame rate and size
+    video_writer = save_video(
+        output_video_frames,
+        output_video_path,
+        fps=fps,
+        frame_size=frame_size,
+        codec=codec,
+        max_queue_size=queue_size if pipelined else 8,
+    )
+    metrics.add_stage_time(
+        "encode", video_writer.encode_seconds, video_writer.frames_written
+    )
 
-            # Draw a semi-transparent black rectangle over the specified area
-            cv2.rectangle(overlay, (start_x, start_y), (end_x, end_y), (0, 0, 0), -1)
+    # A court model shared by the caller was loaded before this run, its load time is not part of it
+    for name, model in (
+        ("court_model", court_line_detector),
+        ("player_model", player_tracker),
+        ("ball_model", ball_tracker),
+    ):
+        if name != "court_model" or "court_line_detector" not in models:
+            metrics.add_model_startup(name, model.load_time, model.warm_up_time)
+    metrics.add_search_window(
+        "ball_model", ball_tracker.windowed_frames, ball_tracker.window_fallbacks
+    )
 
-            # Combine the original and overlay frames using alpha blending
-            alpha = 0.5
-            cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
-            output_video_frames[index] = frame
+    metrics.finish()
+    if metrics_path is not None:
+        metrics.save(
+            metrics_path,
+            input_video_path=input_video_path,
+            frames=video_writer.frames_written,
+            source_fps=fps,
+            read_from_stub=read_from_stub,
+            pipelined=pipelined,
+            workers=workers,
+            batch_size=batch_size,
+        )
 
-            # Draw text labels for player statistics
-            text = "     Player 1     Player 2"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 80, start_y + 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (255, 255, 255),
-                2,
-            )
+    return metrics.get_report()
+
+
+def main_live(
+    source,
+    frame_size=None,
+    fps=None,
+    latency_budget_ms=100,
+    drop_policy="skip_detection",
+    projection="keypoint",
+    court_tracking=False,
+    court_model_mode="eager",
+    ball_search_window=None,
+    court_roi=False,
+    output_video_path="output_videos/live_output_video.mp4",
+    codec="MJPG",
+):
+    # Frames are read on a background thread as the source produces them and analysed one at a time
+    frames, fps = open_live_source(source, frame_size=frame_size, fps=fps)
+    frame_reader = LiveFrameReader(frames)
+    first_frame = frame_reader.peek_first_frame()
+    if first_frame is None:
+        raise ValueError(f"No frames from live source {source}")
 
-            # Draw "Shot Speed" label
-            text = "Shot Speed"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 10, start_y + 80),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.45,
-                (255, 255, 255),
-                1,
-            )
+    # Detection
+    ## Court keypoints of the first frame, followed through camera changes with court_tracking
+    court_line_detector = CourtLineDetector(
+        "models/keypoints_model.pth", mode=court_model_mode
+    )
+    court_keypoints = court_line_detector.predict(first_frame)
+    court_tracker = CourtTracker(court_line_detector) if court_tracking else None
+
+    ## Players and ball, detected on every frame as it arrives
+    roi = get_court_roi(court_keypoints, first_frame.shape) if court_roi else None
+    player_tracker = PlayerTracker(model_path="yolo11x", roi=roi)
+    ball_tracker = BallTracker(
+        model_path="models/yolo11x_last.pt",
+        search_window=(
+            BallSearchWindow(window_size=ball_search_window)
+            if ball_search_window
+            else None
+        ),
+        roi=roi,
+    )
 
-            # Draw actual shot speeds
-            text = f"{player_1_shot_speed:.1f} km/h    {player_2_shot_speed:.1f} km/h"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 130, start_y + 80),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (255, 255, 255),
-                2,
-            )
+    ## The models are warmed up before the first frame is timed, their cold start would otherwise count as the usual analysis time
+    player_tracker.warm_up(first_frame)
+    ball_tracker.warm_up(first_frame)
+
+    # Incremental analysis: mini court, shots and stats are updated on every frame, the drop policy keeps up with the source
+    live_analyzer = LiveAnalyzer(
+        court_line_detector,
+        player_tracker,
+        ball_tracker,
+        MiniCourt(first_frame),
+        court_keypoints,
+        fps=fps,
+        latency_budget=latency_budget_ms / 1000,
+        drop_policy=drop_policy,
+        court_tracker=court_tracker,
+        projection=projection,
+    )
 
-            # Draw "Player Speed" label
-            text = "Player Speed"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 10, start_y + 120),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.45,
-                (255, 255, 255),
-                1,
-            )
+    # Output
+    ## Annotated frames are written as they come out, the stats are appended as a JSON line whenever they change
+    with open("output_videos/live_stats.jsonl", "w") as stats_file:
+
+        def iter_annotated_frames():
+            last_stats_line = None
+            for frame_num, frame, stats in live_analyzer.run(frame_reader):
+                stats_line = json.dumps(stats)
+                if stats_line != last_stats_line:
+                    stats_file.write(
+                        json.dumps({"frame_num": frame_num, **stats}) + "\n"
+                    )
+                    stats_file.flush()
+                    last_stats_line = stats_line
+                yield frame
+
+        save_video(
+            iter_annotated_frames(),
+            output_video_path,
+            fps=fps,
+            frame_size=(first_frame.shape[1], first_frame.shape[0]),
+            codec=codec,
+        )
 
-            # Draw actual player speeds
-            text = f"{player_1_speed:.1f} km/h    {player_2_speed:.1f} km/h"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 130, start_y + 120),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (255, 255, 255),
-                2,
-            )
+    print(json.dumps(live_analyzer.get_latency_report(), indent=2))
 
-            # Draw "avg. S. Speed" label
-            text = "avg. S. Speed"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 10, start_y + 160),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.45,
-                (255, 255, 255),
-                1,
-            )
 
-            # Draw average shot speeds
-            text = f"{avg_player_1_shot_speed:.1f} km/h    {avg_player_2_shot_speed:.1f} km/h"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 130, start_y + 160),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (255, 255, 255),
-                2,
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tennis match analysis")
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="overlap decoding with inference during detection, then decoding, annotation and encoding during rendering (the two passes still run one after the other)",
+    )
+    parser.add_argument(
+        "--no-stubs",
+        action="store_true",
+        help="run the detection models instead of reading the tracker stubs",
+    )
+    parser.add_argument(
+        "--stub-format",
+        choices=list(STUB_EXTENSIONS),
+        default="pkl",
+        help="format of the tracker stubs read or saved: pickled lists, or columnar detections in an .npz archive or a directory of memory-mapped .npy files",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="frames per model call"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=16,
+        help="maximum number of frames waiting between two pipelined stages",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes detecting overlapping segments of the video",
+    )
+    parser.add_argument(
+        "--detection-cache",
+        default=None,
+        help="SQLite file caching detections per frame across runs (use with --no-stubs)",
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=512,
+        help="size above which the least recently used cached detections are evicted",
+    )
+    parser.add_argument(
+        "--projection",
+        choices=["keypoint", "homography"],
+        default="keypoint",
+        help="map positions onto the mini court from the closest keypoint or through the court homography",
+    )
+    parser.add_argument(
+        "--court-tracking",
+        action="store_true",
+        help="re-detect the court keypoints on camera changes instead of using the first frame for the whole video",
+    )
+    parser.add_argument(
+        "--court-model-mode",
+        choices=list(COURT_MODEL_MODES),
+        default="eager",
+        help="inference mode of the court keypoints model",
+    )
+    parser.add_argument(
+        "--ball-search-window",
+        type=int,
+        default=None,
+        help="side in pixels (a multiple of 32) of the window around the predicted ball position searched instead of the whole frame",
+    )
+    parser.add_argument(
+        "--player-stride",
+        type=int,
+        default=1,
+        help="detect players on at most every Nth frame and interpolate the boxes in between, the stride shrinks when players move fast (not with --pipelined)",
+    )
+    parser.add_argument(
+        "--court-roi",
+        action="store_true",
+        help="run player and ball detection only on a padded box around the court, detecting only people with the player model",
+    )
+    parser.add_argument(
+        "--ball-estimator",
+        choices=["interpolate", "kalman"],
+        default="interpolate",
+        help="fill missing ball positions by linear interpolation or with a Kalman filter that also smooths them",
+    )
+    parser.add_argument(
+        "--live",
+        default=None,
+        metavar="SOURCE",
+        help="analyse a live source as it plays: a capture device index, - for raw BGR frames on stdin, a FIFO of raw BGR frames or a growing video file",
+    )
+    parser.add_argument(
+        "--live-frame-size",
+        type=lambda value: tuple(int(size) for size in value.split("x")),
+        default=None,
+        metavar="WIDTHxHEIGHT",
+        help="size of the raw frames of a --live pipe",
+    )
+    parser.add_argument(
+        "--live-fps",
+        type=float,
+        default=None,
+        help="frame rate of a --live pipe (24 by default), devices and files report their own",
+    )
+    parser.add_argument(
+        "--latency-budget-ms",
+        type=float,
+        default=100,
+        help="maximum time in --live mode between a frame arriving and its annotated frame coming out",
+    )
+    parser.add_argument(
+        "--drop-policy",
+        choices=list(DROP_POLICIES),
+        default="skip_detection",
+        help="what --live mode does to frames that would miss the latency budget",
+    )
+    parser.add_argument(
+        "--input-video",
+        default=DEFAULT_INPUT_VIDEO_PATH,
+        help="path of the match video to analyse, the tracker stubs are only read and saved for the default one",
+    )
+    parser.add_argument(
+        "--output-video",
+        default=None,
+        help="path of the annotated video, its extension picks the container (output_videos/output_video.mp4 by default)",
+    )
+    parser.add_argument(
+        "--codec",
+        default="MJPG",
+        help="FourCC of the output video codec, e.g. MJPG, mp4v, avc1 or XVID",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        help="JSON file receiving the wall time, frames per second and memory of every phase and stage of the run",
+    )
+    parser.add_argument(
+        "--latency-histograms",
+        action="store_true",
+        help="keep the latency of every model call and add per-frame latency percentiles and histograms to --metrics",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="run cProfile on the main thread and write its stats to this file (read with python -m pstats)",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="trace Python allocations, adding the high-water mark of every phase and the largest allocation sites to --metrics",
+    )
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        help="load the models that will run and run each one once on the first frame before the analysis, reporting their cold start in --metrics",
+    )
+    args = parser.parse_args()
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    # The stubs hold the detections of the default video, another video is always detected and never overwrites them
+    if os.path.abspath(args.input_video) == os.path.abspath(DEFAULT_INPUT_VIDEO_PATH):
+        stub_dir = "tracker_stubs"
+    else:
+        stub_dir = None
+    read_from_stub = not args.no_stubs and stub_dir is not None
+
+    # Detection modes only apply when the models run, and only one of them runs at a time
+    if args.live is None:
+        if args.workers > 1 and read_from_stub:
+            parser.error(
+                "--workers needs --no-stubs, the stubs already hold the detections"
             )
-
-            # Draw "avg. P. Speed" label
-            text = "avg. P. Speed"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 10, start_y + 200),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.45,
-                (255, 255, 255),
-                1,
+        if read_from_stub and (
+            args.player_stride > 1 or args.court_roi or args.ball_search_window
+        ):
+            parser.error(
+                "--player-stride, --court-roi and --ball-search-window need --no-stubs, the stubs already hold the detections"
             )
-
-            # Draw average player speeds
-            text = f"{avg_player_1_speed:.1f} km/h    {avg_player_2_speed:.1f} km/h"
-            output_video_frames[index] = cv2.putText(
-                output_video_frames[index],
-                text,
-                (start_x + 130, start_y + 200),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (255, 255, 255),
-                2,
+        if args.workers > 1 and args.pipelined:
+            parser.error("--workers and --pipelined cannot be combined")
+        if args.pipelined and args.player_stride > 1:
+            parser.error("--player-stride cannot be combined with --pipelined")
+        if args.detection_cache is not None and (args.workers > 1 or args.pipelined):
+            parser.error(
+                "--detection-cache cannot be combined with --workers or --pipelined"
             )
 
-        return output_video_frames
-
-    ## Draw Player Stats
-    output_video_frames = draw_player_stats(output_video_frames, player_stats_data_df)
-
-    # Combines frames to video
-    save_video(output_video_frames, "output_videos/output_video.mp4")
-
-
-if __name__ == "__main__":
-    main()
+    if args.live is not None:
+        main_live(
+            args.live,
+            frame_size=args.live_frame_size,
+            fps=args.live_fps,
+            latency_budget_ms=args.latency_budget_ms,
+            drop_policy=args.drop_policy,
+            projection=args.projection,
+            court_tracking=args.court_tracking,
+            court_model_mode=args.court_model_mode,
+            ball_search_window=args.ball_search_window,
+            court_roi=args.court_roi,
+            output_video_path=args.output_video
+            or "output_videos/live_output_video.mp4",
+            codec=args.codec,
+        )
+    else:
+        main(
+            input_video_path=args.input_video,
+            pipelined=args.pipelined,
+            read_from_stub=read_from_stub,
+            batch_size=args.batch_size,
+            queue_size=args.queue_size,
+            workers=args.workers,
+            detection_cache_path=args.detection_cache,
+            cache_size_mb=args.cache_size_mb,
+            projection=args.projection,
+            court_tracking=args.court_tracking,
+            court_model_mode=args.court_model_mode,
+            ball_search_window=args.ball_search_window,
+            player_stride=args.player_stride,
+            court_roi=args.court_roi,
+            ball_estimator=args.ball_estimator,
+            output_video_path=args.output_video or "output_videos/output_video.mp4",
+            codec=args.codec,
+            metrics_path=args.metrics,
+            latency_histograms=args.latency_histograms,
+            profile_path=args.profile,
+            trace_allocations=args.tracemalloc,
+            stub_dir=stub_dir,
+            stub_format=args.stub_format,
+            warm_up=args.warm_up,
+        )
@@ -1,19 +1,17 @@
 import cv2
 import numpy as np
 import sys
+from numpy.lib.stride_tricks import sliding_window_view
 
 sys.path.append("../")
 import constants
 
 from utils import (
+    Detections,
+    Sprite,
     convert_meters_to_pixel_distance,
     convert_pixel_distance_to_meters,
-    get_foot_position,
-    get_closest_keypoint_index,
-    get_height_of_bbox,
-    get_center_of_bbox,
     measure_xy_distance,
-    measure_distance,
 )
 
 
@@ -29,6 +27,7 @@ class MiniCourt:
         self.set_mini_court_position()
         self.set_court_drawing_key_points()
         self.set_court_lines()
+        self.set_mini_court_sprite()
 
     # Background box
     ## Sets the position of the background box
@@ -40,25 +39,14 @@ class MiniCourt:
         self.start_x = self.end_x - self.drawing_rectangle_width
         self.start_y = self.end_y - self.drawing_rectangle_height
 
-    ## Draws the background box
+    ## Draws the background box on the frame in place, blending only the pixels of the box
     def draw_background_rectangle(self, frame):
-        shapes = np.zeros_like(frame, np.uint8)
+        roi = frame[self.start_y : self.end_y + 1, self.start_x : self.end_x + 1]
 
-        # Draw the rectangle
-        cv2.rectangle(
-            shapes,
-            (self.start_x, self.start_y),
-            (self.end_x, self.end_y),
-            (255, 255, 255),
-            cv2.FILLED,
-        )
-
-        out = frame.copy()
         alpha = 0.5
-        mask = shapes.astype(bool)
-        out[mask] = cv2.addWeighted(frame, alpha, shapes, 1 - alpha, 0)[mask]
+        cv2.addWeighted(roi, alpha, np.full_like(roi, 255), 1 - alpha, 0, dst=roi)
 
-        return out
+        return frame
 
     # Mini court
     ## Sets the position of the mini court
@@ -177,35 +165,53 @@ class MiniCourt:
             (2, 3),
         ]
 
-    ## Draw the court lines and keypoints
-    def draw_court(self, frame):
+    ## Pre-renders the background box and the court once as a sprite
+    ## The box is white at half opacity, the lines and keypoints drawn over it are opaque
+    def set_mini_court_sprite(self):
+        height = self.end_y - self.start_y + 1
+        width = self.end_x - self.start_x + 1
+
+        image = np.full((height, width, 3), 255, np.uint8)
+        self.draw_court(image, origin=(self.start_x, self.start_y))
+
+        # Every pixel the court drawing changed is opaque
+        alpha = np.where((image != 255).any(axis=2), 1.0, 0.5).astype(np.float32)
+
+        self.mini_court_sprite = Sprite(image, alpha)
+
+    ## Draw the court lines and keypoints, origin is the frame position of the image's top left corner
+    def draw_court(self, frame, origin=(0, 0)):
+        origin_x, origin_y = origin
+
         # Draw lines
         for line in self.lines:
             start_point = (
-                int(self.drawing_key_points[line[0] * 2]),
-                int(self.drawing_key_points[line[0] * 2 + 1]),
+                int(self.drawing_key_points[line[0] * 2]) - origin_x,
+                int(self.drawing_key_points[line[0] * 2 + 1]) - origin_y,
             )
             end_point = (
-                int(self.drawing_key_points[line[1] * 2]),
-                int(self.drawing_key_points[line[1] * 2 + 1]),
+                int(self.drawing_key_points[line[1] * 2]) - origin_x,
+                int(self.drawing_key_points[line[1] * 2 + 1]) - origin_y,
             )
             cv2.line(frame, start_point, end_point, (0, 0, 0), 2)
 
         # Draw key points
         for i in range(0, len(self.drawing_key_points), 2):
-            x = int(self.drawing_key_points[i])
-            y = int(self.drawing_key_points[i + 1])
+            x = int(self.drawing_key_points[i]) - origin_x
+            y = int(self.drawing_key_points[i + 1]) - origin_y
             cv2.circle(frame, (x, y), 5, (0, 0, 255), -1)
 
         # Draw net
         net_start_point = (
-            self.drawing_key_points[0],
-            int((self.drawing_key_points[1] + self.drawing_key_points[5]) / 2),
+            self.drawing_key_points[0] - origin_x,
+            int((self.drawing_key_points[1] + self.drawing_key_points[5]) / 2)
+            - origin_y,
         )
 
         net_end_point = (
-            self.drawing_key_points[2],
-            int((self.drawing_key_points[1] + self.drawing_key_points[5]) / 2),
+            self.drawing_key_points[2] - origin_x,
+            int((self.drawing_key_points[1] + self.drawing_key_points[5]) / 2)
+            - origin_y,
         )
         cv2.line(frame, net_start_point, net_end_point, (255, 0, 0), 2)
 
@@ -221,97 +227,246 @@ class MiniCourt:
     def get_court_drawing_keypoints(self):
         return self.drawing_key_points
 
-    ## Draws the background and mini court elements on screen
+    ## Draws the background and mini court elements on screen, yielding the frames one at a time
     def draw_mini_court(self, frames):
-        output_frames = []
         for frame in frames:
-            frame = self.draw_background_rectangle(frame)
-            frame = self.draw_court(frame)
-            output_frames.append(frame)
-        return output_frames
+            yield self.draw_mini_court_on_frame(frame)
+
+    ## Draws the background and mini court elements on one frame in place, as a single blend of the cached sprite over the box
+    def draw_mini_court_on_frame(self, frame):
+        return self.mini_court_sprite.blend_into(frame, self.start_x, self.start_y)
 
     # Processes player and ball bounding boxes to obtain their positions on the mini court based on court key points and player heights
+    # With projection="homography" the positions are projected through the homography fitted on all 14 court keypoints instead
+    # Boxes can be lists of per-frame dictionaries or Detections, the positions come back as lists of per-frame dictionaries
+    # The court keypoints can be one set for the whole video or a (frames, 28) array from a CourtTracker
     def convert_bounding_boxes_to_mini_court_coordinates(
-        self, player_boxes, ball_boxes, original_court_key_points
+        self, player_boxes, ball_boxes, original_court_key_points, projection="keypoint"
     ):
+        player_ids, player_positions, player_mask, ball_positions, ball_mask = (
+            self.convert_bounding_boxes_to_mini_court_arrays(
+                player_boxes, ball_boxes, original_court_key_points, projection
+            )
+        )
+
+        player_ids = player_ids.tolist()
+
+        output_player_boxes = [
+            {
+                player_id: tuple(position)
+                for player_id, position, present in zip(
+                    player_ids, frame_positions, frame_mask
+                )
+                if present
+            }
+            for frame_positions, frame_mask in zip(
+                player_positions.tolist(), player_mask.tolist()
+            )
+        ]
+
+        output_ball_boxes = [
+            {1: tuple(position)} if present else {}
+            for position, present in zip(ball_positions.tolist(), ball_mask.tolist())
+        ]
+
+        return output_player_boxes, output_ball_boxes
+
+    # Array version of convert_bounding_boxes_to_mini_court_coordinates, working on every frame at once
+    # Returns the player IDs, their (frames, players, 2) positions with a (frames, players) mask, and the (frames, 2) ball positions with a (frames,) mask
+    def convert_bounding_boxes_to_mini_court_arrays(
+        self, player_boxes, ball_boxes, original_court_key_points, projection="keypoint"
+    ):
+        if projection not in ("keypoint", "homography"):
+            raise ValueError(f"Unknown projection: {projection}")
+
         player_heights = {
             1: constants.PLAYER_1_HEIGHT_METERS,
             2: constants.PLAYER_2_HEIGHT_METERS,
         }
 
-        output_player_boxes = []
-        output_ball_boxes = []
+        if not isinstance(player_boxes, Detections):
+            player_boxes = Detections.from_list(player_boxes)
+        if not isinstance(ball_boxes, Detections):
+            ball_boxes = Detections.from_list(ball_boxes)
+
+        player_ids = player_boxes.get_track_ids()
+        player_bboxes, player_mask = player_boxes.to_dense(player_ids)
+        ball_bboxes, ball_mask = ball_boxes.to_dense([1])
+        ball_bboxes, ball_mask = ball_bboxes[:, 0], ball_mask[:, 0]
+
+        # Keypoint arithmetic runs in the keypoints' dtype (float32 from the court model) like the scalar version did
+        original_court_key_points = np.asarray(original_court_key_points)
+        if not np.issubdtype(original_court_key_points.dtype, np.floating):
+            original_court_key_points = original_court_key_points.astype(np.float64)
+
+        # Foot positions of the players and centres of the ball, in whole pixels
+        foot_positions = np.stack(
+            [
+                np.trunc((player_bboxes[..., 0] + player_bboxes[..., 2]) / 2),
+                player_bboxes[..., 3],
+            ],
+            axis=-1,
+        )
+        ball_positions = np.trunc(
+            np.stack(
+                [
+                    (ball_bboxes[:, 0] + ball_bboxes[:, 2]) / 2,
+                    (ball_bboxes[:, 1] + ball_bboxes[:, 3]) / 2,
+                ],
+                axis=-1,
+            )
+        )
 
-        for frame_num, player_bbox in enumerate(player_boxes):
-            ball_box = ball_boxes[frame_num][1]
-            ball_position = get_center_of_bbox(ball_box)
+        if projection == "homography":
+            # Players' feet and ball centres of the whole video go through one perspective transform per set of court keypoints
+            points = np.concatenate([foot_positions, ball_positions[:, None]], axis=1)
+            projected_points = np.empty(points.shape, np.float32)
+
+            if original_court_key_points.ndim == 1:
+                frame_groups = [(original_court_key_points, slice(None))]
+            else:
+                # Per-frame keypoints repeat between keyframes, a homography is fitted once per distinct set
+                unique_key_points, frame_group = np.unique(
+                    original_court_key_points, axis=0, return_inverse=True
+                )
+                frame_group = frame_group.reshape(-1)
+                frame_groups = [
+                    (key_points, frame_group == group)
+                    for group, key_points in enumerate(unique_key_points)
+                ]
 
-            closest_player_id_to_ball = min(
-                player_bbox.keys(),
-                key=lambda x: measure_distance(
-                    ball_position, get_center_of_bbox(player_bbox[x])
-                ),
+            for key_points, frames in frame_groups:
+                homography = self.get_court_homography(key_points)
+                group_points = points[frames]
+                projected_points[frames] = cv2.perspectiveTransform(
+                    group_points.reshape(-1, 1, 2).astype(np.float32), homography
+                ).reshape(group_points.shape)
+
+            player_positions = projected_points[:, :-1]
+            ball_positions = projected_points[:, -1]
+
+            return player_ids, player_positions, player_mask, ball_positions, ball_mask
+
+        # Player closest to the ball on every frame, comparing the centres of their boxes
+        player_centers = np.trunc(
+            np.stack(
+                [
+                    (player_bboxes[..., 0] + player_bboxes[..., 2]) / 2,
+                    (player_bboxes[..., 1] + player_bboxes[..., 3]) / 2,
+                ],
+                axis=-1,
             )
+        )
+        distances_to_ball = np.linalg.norm(
+            player_centers - ball_positions[:, None], axis=-1
+        )
+        distances_to_ball[~player_mask] = np.inf
+        closest_player_to_ball = np.argmin(distances_to_ball, axis=1)
 
-            output_player_bboxes_dict = {}
-
-            for player_id, bbox in player_bbox.items():
-                foot_position = get_foot_position(bbox)
+        # Player height in pixels: tallest box of the player from 20 frames before to 50 frames after the current frame
+        bbox_heights = np.where(
+            player_mask, player_bboxes[..., 3] - player_bboxes[..., 1], -np.inf
+        )
+        padded_heights = np.pad(
+            bbox_heights, ((20, 49), (0, 0)), constant_values=-np.inf
+        )
+        max_player_heights_in_pixels = sliding_window_view(
+            padded_heights, 70, axis=0
+        ).max(axis=-1)
+
+        player_heights_in_meters = np.array(
+            [player_heights[int(player_id)] for player_id in player_ids]
+        ).reshape(1, -1)
+
+        player_positions = self.get_mini_court_coordinates_array(
+            foot_positions,
+            original_court_key_points,
+            max_player_heights_in_pixels,
+            player_heights_in_meters,
+        )
 
-                # Get the closest keypoint in pixels
-                closest_key_point_index = get_closest_keypoint_index(
-                    foot_position, original_court_key_points, [0, 2, 12, 13]
-                )
+        # The ball is scaled with the height of the player closest to it
+        frames = np.arange(len(ball_positions))
+        ball_positions = self.get_mini_court_coordinates_array(
+            ball_positions,
+            original_court_key_points,
+            max_player_heights_in_pixels[frames, closest_player_to_ball],
+            player_heights_in_meters[0, closest_player_to_ball],
+        )
+        ball_mask = ball_mask & player_mask.any(axis=1)
 
-                closest_key_point = (
-                    original_court_key_points[closest_key_point_index * 2],
-                    original_court_key_points[closest_key_point_index * 2 + 1],
-                )
+        return player_ids, player_positions, player_mask, ball_positions, ball_mask
 
-                # Get player height in pixels
-                frame_index_min = max(0, frame_num - 20)
-                frame_index_max = min(len(player_boxes), frame_num + 50)
+    # Fits the homography mapping the 14 court keypoints of the video onto the mini court keypoints
+    # RANSAC leaves out keypoints the court model got badly wrong
+    def get_court_homography(self, original_court_key_points):
+        source_points = np.asarray(original_court_key_points, np.float32).reshape(-1, 2)
+        destination_points = np.asarray(self.drawing_key_points, np.float32).reshape(
+            -1, 2
+        )
 
-                bboxes_heights_in_pixels = [
-                    get_height_of_bbox(player_boxes[i][player_id])
-                    for i in range(frame_index_min, frame_index_max)
-                ]
+        homography, _ = cv2.findHomography(
+            source_points, destination_points, cv2.RANSAC, 5.0
+        )
+        if homography is None:
+            raise ValueError("Could not fit a homography to the court keypoints")
 
-                max_player_height_in_pixels = max(bboxes_heights_in_pixels)
+        return homography
 
-                mini_court_player_position = self.get_mini_court_coordinates(
-                    foot_position,
-                    closest_key_point,
-                    closest_key_point_index,
-                    max_player_height_in_pixels,
-                    player_heights[player_id],
-                )
+    # Array version of get_mini_court_coordinates: positions (..., 2) are placed relative to the closest of the keypoints 0, 2, 12 and 13 (by y distance)
+    # The court keypoints are either one set of 28 values or one set per frame, (frames, 28) with positions of shape (frames, ..., 2)
+    def get_mini_court_coordinates_array(
+        self,
+        object_positions,
+        original_court_key_points,
+        player_heights_in_pixels,
+        player_heights_in_meters,
+        keypoint_indices=(0, 2, 12, 13),
+    ):
+        dtype = original_court_key_points.dtype
+        keypoint_indices = np.array(keypoint_indices)
+        keypoints = original_court_key_points.reshape(
+            original_court_key_points.shape[:-1] + (-1, 2)
+        )[..., keypoint_indices, :]
+        object_positions = object_positions.astype(dtype)
+
+        # Per-frame keypoints (frames, 28) are lined up with the frame axis of the positions
+        if keypoints.ndim == 3:
+            keypoints = keypoints.reshape(
+                keypoints.shape[:1]
+                + (1,) * (object_positions.ndim - 2)
+                + keypoints.shape[1:]
+            )
+        keypoints = np.broadcast_to(
+            keypoints, object_positions.shape[:-1] + keypoints.shape[-2:]
+        )
 
-                output_player_bboxes_dict[player_id] = mini_court_player_position
+        # Get the closest keypoint in pixels
+        closest = np.argmin(
+            np.abs(object_positions[..., 1, None] - keypoints[..., 1]), axis=-1
+        )
+        closest_key_points = np.take_along_axis(
+            keypoints, closest[..., None, None], axis=-2
+        )[..., 0, :]
 
-                if closest_player_id_to_ball == player_id:
-                    # Get the closest keypoint in pixels
-                    closest_key_point_index = get_closest_keypoint_index(
-                        ball_position, original_court_key_points, [0, 2, 12, 13]
-                    )
+        distance_from_keypoint_pixels = np.abs(object_positions - closest_key_points)
 
-                    closest_key_point = (
-                        original_court_key_points[closest_key_point_index * 2],
-                        original_court_key_points[closest_key_point_index * 2 + 1],
-                    )
+        # Convert pixel distance to meters
+        distance_from_keypoint_meters = (
+            distance_from_keypoint_pixels
+            * np.asarray(player_heights_in_meters, dtype)[..., None]
+        ) / np.asarray(player_heights_in_pixels, dtype)[..., None]
 
-                    mini_court_player_position = self.get_mini_court_coordinates(
-                        ball_position,
-                        closest_key_point,
-                        closest_key_point_index,
-                        max_player_height_in_pixels,
-                        player_heights[player_id],
-                    )
+        # Convert to mini court coordinates
+        mini_court_distance_pixels = (
+            distance_from_keypoint_meters * dtype.type(self.court_drawing_width)
+        ) / dtype.type(constants.DOUBLE_LINE_WIDTH)
 
-                    output_ball_boxes.append({1: mini_court_player_position})
-            output_player_boxes.append(output_player_bboxes_dict)
+        mini_court_key_points = np.asarray(self.drawing_key_points, np.float64).reshape(
+            -1, 2
+        )[keypoint_indices]
 
-        return output_player_boxes, output_ball_boxes
+        return mini_court_key_points[closest].astype(dtype) + mini_court_distance_pixels
 
     # Calculates the mini court coordinates of a player based on their position relative to key points
     def get_mini_court_coordinates(
@@ -360,12 +515,16 @@ class MiniCourt:
 
         return mini_court_player_position
 
-    # Draws a point on mini court based on coord
+    # Draws a point on mini court based on coord, yielding the frames one at a time
     def draw_points_on_mini_court(self, frames, postions, color=(0, 255, 0)):
         for frame_num, frame in enumerate(frames):
-            for _, position in postions[frame_num].items():
-                x, y = position
-                x = int(x)
-                y = int(y)
-                cv2.circle(frame, (x, y), 5, color, -1)
-        return frames
+            yield self.draw_points_on_frame(frame, postions[frame_num], color)
+
+    # Draws the points of one frame's positions on the mini court in place
+    def draw_points_on_frame(self, frame, positions, color=(0, 255, 0)):
+        for _, position in positions.items():
+            x, y = position
+            x = int(x)
+            y = int(y)
+            cv2.circle(frame, (x, y), 5, color, -1)
+        return frame
@@ -0,0 +1,3 @@
+from .threaded_pipeline import ThreadedPipeline
+from .segment_parallel import detect_frames_in_parallel
+from .pipeline_metrics import PipelineMetrics
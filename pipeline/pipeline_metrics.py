@@ -0,0 +1,260 @@
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out of the metrics there
+    resource = None
+
+# Upper bounds in milliseconds of the per-frame latency histogram buckets, the last bucket holds everything slower
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+# Peak resident set size of the process so far in MB, None where it cannot be read
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+
+class PipelineMetrics:
+    # Records where the time and memory of a run go
+    # Phases are the consecutive steps of a run (court detection, player and ball detection, mini court...): wall time, peak RSS and, with trace_allocations, the tracemalloc high-water mark of each one
+    # Stages are the kinds of work interleaved inside the phases (decoding, each model, each draw pass, encoding): time spent in them, frames and frames per second
+    # Stage times are exclusive, a stage timed inside another one (decoding pulled by the renderer) is not counted twice
+    # With latency_histograms every model call is kept, to give per-frame latency percentiles and a histogram per model
+    # With profile_path, cProfile runs on the calling thread from start to finish and its stats are written there
+    def __init__(
+        self, latency_histograms=False, trace_allocations=False, profile_path=None
+    ):
+        self.latency_histograms = latency_histograms
+        self.trace_allocations = trace_allocations
+        self.profile_path = profile_path
+
+        self.phases = {}
+        self.current_phase = None
+        self.stages = {}
+        self.call_latencies = {}
+        self.model_startup = {}
+        self.search_windows = {}
+        self.lock = threading.Lock()
+
+        # Stages being timed on each thread, innermost last, as [stage name, time spent in nested stages]
+        self.local = threading.local()
+
+        self.profiler = None
+        self.start_time = None
+        self.wall_seconds = None
+        self.top_allocations = []
+
+    # Starts the run, with the profiler and allocation tracing if enabled
+    def start(self):
+        if self.trace_allocations:
+            tracemalloc.start()
+        if self.profile_path is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start_time = time.perf_counter()
+        return self
+
+    # Ends the run, writing the profile and keeping the largest allocation sites still alive
+    def finish(self):
+        self.end_phase()
+        self.wall_seconds = time.perf_counter() - self.start_time
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        if self.trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            self.top_allocations = [
+                {
+                    "location": str(statistic.traceback),
+                    "size_mb": statistic.size / 2**20,
+                    "count": statistic.count,
+                }
+                for statistic in snapshot.statistics("lineno")[:10]
+            ]
+            tracemalloc.stop()
+
+    # Starts the next phase of the run, ending the current one
+    def start_phase(self, name):
+        self.end_phase()
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        self.current_phase = (name, time.perf_counter(), get_peak_rss_mb())
+
+    # Ends the current phase, recording its wall time and memory high-water marks
+    def end_phase(self):
+        if self.current_phase is None:
+            return
+        name, start_time, peak_rss_before = self.current_phase
+        self.current_phase = None
+
+        phase = self.phases.setdefault(name, {"seconds": 0.0})
+        phase["seconds"] += time.perf_counter() - start_time
+        peak_rss = get_peak_rss_mb()
+        if peak_rss is not None:
+            phase["peak_rss_mb"] = peak_rss
+            phase["peak_rss_growth_mb"] = (
+                phase.get("peak_rss_growth_mb", 0.0) + peak_rss - peak_rss_before
+            )
+        if self.trace_allocations:
+            phase["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+
+    # Times a block of work of a stage processing number_of_frames frames
+    @contextmanager
+    def stage(self, name, number_of_frames=0):
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append([name, 0.0])
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            _, nested_seconds = stack.pop()
+            if stack:
+                stack[-1][1] += seconds
+            self.add_stage_time(name, seconds - nested_seconds, number_of_frames)
+
+    def add_stage_time(self, name, seconds, number_of_frames=0):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "frames": 0})
+            stage["seconds"] += seconds
+            stage["frames"] += number_of_frames
+
+    # Records the cold start of a model: seconds taken to load it and by its warm-up call, None for what did not happen in this run
+    def add_model_startup(self, name, load_seconds=None, warm_up_seconds=None):
+        if load_seconds is None and warm_up_seconds is None:
+            return
+        self.model_startup[name] = {
+            "load_seconds": load_seconds,
+            "warm_up_seconds": warm_up_seconds,
+        }
+
+    # Records how often a model searching windows around predicted positions missed there and had to search the whole frame
+    def add_search_window(self, name, windowed_frames, fallback_frames):
+        if windowed_frames == 0:
+            return
+        self.search_windows[name] = {
+            "windowed_frames": windowed_frames,
+            "fallback_frames": fallback_frames,
+            "fallback_rate": fallback_frames / windowed_frames,
+        }
+
+    # Wraps an iterator so the time spent producing each item counts towards a stage, one frame per item
+    def time_iterator(self, name, iterator):
+        iterator = iter(iterator)
+        while True:
+            with self.stage(name, 1):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # Replaces a method of an object with a timed one, the frames of a call are the length of its first argument
+    # With model=True and latency_histograms, the latency of every call is kept as well
+    # An object instrumented by an earlier run (a model reused across videos) is re-instrumented from its original method
+    def instrument(self, obj, method_name, stage_name, model=False):
+        method = getattr(obj, method_name)
+        method = getattr(method, "instrumented_method", method)
+
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            number_of_frames = len(args[0]) if args else 0
+            start_time = time.perf_counter()
+            with self.stage(stage_name, number_of_frames):
+                result = method(*args, **kwargs)
+            if model and self.latency_histograms:
+                with self.lock:
+                    self.call_latencies.setdefault(stage_name, []).append(
+                        (number_of_frames, time.perf_counter() - start_time)
+                    )
+            return result
+
+        timed_method.instrumented_method = method
+        setattr(obj, method_name, timed_method)
+        return obj
+
+    # Times every overlay of a FrameRenderer as its own draw stage
+    def instrument_renderer(self, renderer):
+        renderer.overlays = [
+            (name, self.timed_overlay(f"draw_{name}", draw))
+            for name, draw in renderer.overlays
+        ]
+        return renderer
+
+    def timed_overlay(self, stage_name, draw):
+        def timed_draw(frame, frame_num):
+            with self.stage(stage_name, 1):
+                return draw(frame, frame_num)
+
+        return timed_draw
+
+    # Per-frame latency percentiles and histogram of each model, from the latency of its calls
+    def get_latency_report(self):
+        report = {}
+        for stage_name, calls in self.call_latencies.items():
+            frames = np.array([number_of_frames for number_of_frames, _ in calls])
+            seconds = np.array([seconds for _, seconds in calls])
+            frame_ms = seconds / np.maximum(frames, 1) * 1000
+
+            counts, _ = np.histogram(
+                frame_ms, bins=(0,) + LATENCY_BUCKETS_MS + (np.inf,)
+            )
+            report[stage_name] = {
+                "calls": len(calls),
+                "frames": int(frames.sum()),
+                "mean_call_ms": float(seconds.mean() * 1000),
+                "p50_frame_ms": float(np.percentile(frame_ms, 50)),
+                "p95_frame_ms": float(np.percentile(frame_ms, 95)),
+                "p99_frame_ms": float(np.percentile(frame_ms, 99)),
+                "max_frame_ms": float(frame_ms.max()),
+                "histogram": {
+                    "bucket_upper_ms": list(LATENCY_BUCKETS_MS) + [None],
+                    "counts": counts.tolist(),
+                },
+            }
+        return report
+
+    # Returns every metric of the run as a JSON-serializable dictionary
+    def get_report(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage)
+            if stage["frames"] and stage["seconds"] > 0:
+                stages[name]["fps"] = stage["frames"] / stage["seconds"]
+
+        report = {
+            "wall_seconds": self.wall_seconds,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "phases": self.phases,
+            "stages": stages,
+        }
+        if self.model_startup:
+            report["model_startup"] = self.model_startup
+        if self.search_windows:
+            report["search_windows"] = self.search_windows
+        if self.latency_histograms:
+            report["model_latency"] = self.get_latency_report()
+        if self.trace_allocations:
+            report["top_allocations"] = self.top_allocations
+        if self.profile_path is not None:
+            report["profile_path"] = self.profile_path
+        return report
+
+    # Writes the report as JSON
+    def save(self, metrics_path, **run_info):
+        with open(metrics_path, "w") as f:
+            json.dump({"run": run_info, **self.get_report()}, f, indent=2)
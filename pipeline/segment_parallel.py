@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append("../")
+from trackers import BallSearchWindow, BallTracker, PlayerTracker
+from utils import get_video_frame_count, iter_video_frames, match_track_ids
+
+# Trackers of the current worker process, loaded once by init_segment_worker
+_worker_trackers = {}
+
+
+# Splits the frames of a video into consecutive segments, returning (read_start, start, end) for each one
+# A segment owns the frames [start, end) and also reads the overlap frames before them, so its tracker is warmed up and its IDs can be matched to the previous segment
+def split_into_segments(number_of_frames, number_of_segments, overlap):
+    segment_length = -(-number_of_frames // number_of_segments)
+
+    segments = []
+    for start in range(0, number_of_frames, segment_length):
+        end = min(start + segment_length, number_of_frames)
+        read_start = max(0, start - overlap)
+        segments.append((read_start, start, end))
+
+    return segments
+
+
+# Loads the trackers once per worker process, the worker's torch threads are its share of the CPU cores
+def init_segment_worker(
+    player_model_path,
+    ball_model_path,
+    ball_search_window=None,
+    player_stride=1,
+    roi=None,
+    num_threads=None,
+):
+    if num_threads is not None:
+        import torch
+
+        torch.set_num_threads(num_threads)
+
+    _worker_trackers["player"] = PlayerTracker(
+        model_path=player_model_path, max_stride=player_stride, roi=roi
+    )
+    _worker_trackers["ball"] = BallTracker(
+        model_path=ball_model_path,
+        search_window=(
+            BallSearchWindow(window_size=ball_search_window)
+            if ball_search_window
+            else None
+        ),
+        roi=roi,
+    )
+    _worker_trackers["player"].load_model()
+    _worker_trackers["ball"].load_model()
+
+
+# Runs both trackers on the frames [read_start, end) of the video
+# A worker can get segments that are not next to each other, the tracks and the ball window of its previous segment are forgotten first
+def detect_segment(video_path, read_start, end, batch_size):
+    player_tracker = _worker_trackers["player"]
+    ball_tracker = _worker_trackers["ball"]
+    player_tracker.reset_tracking()
+    if ball_tracker.search_window is not None:
+        ball_tracker.search_window.reset()
+
+    frames = iter_video_frames(video_path, start_frame=read_start, end_frame=end)
+    player_detections = player_tracker.detect_frames(frames, batch_size=batch_size)
+
+    frames = iter_video_frames(video_path, start_frame=read_start, end_frame=end)
+    ball_detections = ball_tracker.detect_frames(frames, batch_size=batch_size)
+
+    return player_detections, ball_detections
+
+
+# Checks every segment got the frames it was given, the segments come from the frame count of the container and seeking, which can both be off
+# A container over-reporting its frame count only shortens the last segment, which is clamped to the frames actually decoded
+def clamp_segments(video_path, segments, segment_results):
+    clamped_segments = []
+    for index, (
+        (read_start, start, end),
+        (segment_players, segment_balls),
+    ) in enumerate(zip(segments, segment_results)):
+        decoded_end = read_start + min(len(segment_players), len(segment_balls))
+        if decoded_end != end:
+            if index < len(segments) - 1 or decoded_end < start:
+                raise ValueError(
+                    f"Segment [{read_start}, {end}) of {video_path} gave {decoded_end - read_start} frames instead of {end - read_start}"
+                )
+            end = decoded_end
+        clamped_segments.append((read_start, start, end))
+    return clamped_segments
+
+
+# Joins the segment detections into detections for the whole video
+# Overlap frames are taken from the earlier segment, player IDs of later segments are reconciled through the overlap
+def stitch_segments(segments, segment_results):
+    player_detections = []
+    ball_detections = []
+    next_track_id = 1
+
+    for (read_start, start, end), (segment_players, segment_balls) in zip(
+        segments, segment_results
+    ):
+        overlap_length = start - read_start
+
+        if start == 0:
+            # The first segment keeps the IDs given by its tracker
+            id_mapping = {
+                track_id: track_id
+                for player_dict in segment_players
+                for track_id in player_dict
+            }
+            next_track_id = max(id_mapping.values(), default=0) + 1
+        else:
+            id_mapping, next_track_id = match_track_ids(
+                player_detections[read_start:start],
+                segment_players[:overlap_length],
+                next_track_id,
+            )
+
+        # Tracks first seen after the overlap get new IDs
+        for player_dict in segment_players[overlap_length : end - read_start]:
+            for track_id in player_dict:
+                if track_id not in id_mapping:
+                    id_mapping[track_id] = next_track_id
+                    next_track_id += 1
+            player_detections.append(
+                {id_mapping[track_id]: bbox for track_id, bbox in player_dict.items()}
+            )
+        ball_detections.extend(segment_balls[overlap_length : end - read_start])
+
+    return player_detections, ball_detections
+
+
+# Splits the video into overlapping segments, detects players and ball on each one in a pool of worker processes and stitches the results
+# Ball interpolation, shot detection and mini court conversion run afterwards on the stitched detections, so they behave the same at the seams as anywhere else
+def detect_frames_in_parallel(
+    video_path,
+    player_model_path,
+    ball_model_path,
+    number_of_workers,
+    overlap=48,
+    batch_size=8,
+    ball_search_window=None,
+    player_stride=1,
+    roi=None,
+):
+    number_of_frames = get_video_frame_count(video_path)
+    segments = split_into_segments(number_of_frames, number_of_workers, overlap)
+
+    # Spawned workers do not inherit the parent's torch threads and CUDA state, each one gets its share of the cores so they do not oversubscribe the CPU
+    num_threads = max(1, (os.cpu_count() or 1) // number_of_workers)
+    with ProcessPoolExecutor(
+        max_workers=number_of_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_segment_worker,
+        initargs=(
+            player_model_path,
+            ball_model_path,
+            ball_search_window,
+            player_stride,
+            roi,
+            num_threads,
+        ),
+    ) as executor:
+        futures = [
+            executor.submit(detect_segment, video_path, read_start, end, batch_size)
+            for read_start, _, end in segments
+        ]
+        segment_results = [future.result() for future in futures]
+
+    segments = clamp_segments(video_path, segments, segment_results)
+
+    return stitch_segments(segments, segment_results)
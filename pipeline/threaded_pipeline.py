@@ -0,0 +1,117 @@
+import queue
+import threading
+
+# Marks the end of the stream in a queue
+_END_OF_STREAM = object()
+
+
+# Carries an exception raised inside a stage down the queues so it can be re-raised by the consumer
+class _StageError:
+    def __init__(self, stage_name, error):
+        self.stage_name = stage_name
+        self.error = error
+
+
+# Raised inside a stage when an earlier stage failed, so the original error reaches the consumer unchanged
+class _UpstreamError(Exception):
+    def __init__(self, stage_error):
+        super().__init__(stage_error.stage_name)
+        self.stage_error = stage_error
+
+
+class ThreadedPipeline:
+    # Runs the source and every stage in its own thread, connected by bounded queues
+    # A full queue blocks the stage feeding it (backpressure), so fast stages wait for slow ones instead of piling up frames
+    def __init__(self, source, max_queue_size=8):
+        self.source = source
+        self.max_queue_size = max_queue_size
+        self.stages = []
+        self.stop_event = threading.Event()
+
+    # Adds a stage, a function that takes an iterator over the items of the previous stage and yields its own items
+    # Generator passes such as PlayerTracker.draw_bboxes can therefore be used as stages directly
+    def add_stage(self, name, function):
+        self.stages.append((name, function))
+        return self
+
+    # Iterating over the pipeline starts the threads and yields the items of the last stage as they become ready
+    def __iter__(self):
+        self.stop_event.clear()
+        queues = [
+            queue.Queue(maxsize=self.max_queue_size)
+            for _ in range(len(self.stages) + 1)
+        ]
+
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=("source", lambda _: self.source, None, queues[0]),
+                daemon=True,
+            )
+        ]
+        for stage_index, (name, function) in enumerate(self.stages):
+            threads.append(
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(name, function, queues[stage_index], queues[stage_index + 1]),
+                    daemon=True,
+                )
+            )
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in self._iter_queue(queues[-1]):
+                yield item
+        except _UpstreamError as e:
+            raise e.stage_error.error
+        finally:
+            # Unblocks every stage if the consumer stops early or a stage failed
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    # Feeds the items produced by a stage into its output queue, forwarding the end of stream or an error
+    def _run_stage(self, name, function, input_queue, output_queue):
+        items = self._iter_queue(input_queue) if input_queue is not None else None
+        try:
+            for item in function(items):
+                if not self._put(output_queue, item):
+                    return
+        except _UpstreamError as e:
+            self._put(output_queue, e.stage_error)
+            return
+        except Exception as e:
+            self._put(output_queue, _StageError(name, e))
+            return
+        self._put(output_queue, _END_OF_STREAM)
+
+    # Yields the items of a queue until the end of stream, raising if an earlier stage failed
+    def _iter_queue(self, input_queue):
+        while True:
+            item = self._get(input_queue)
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, _StageError):
+                raise _UpstreamError(item)
+            yield item
+
+    # Puts an item in a queue, giving up if the pipeline is being stopped
+    def _put(self, output_queue, item):
+        while not self.stop_event.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Gets an item from a queue, ending the stream if the pipeline is being stopped
+    def _get(self, input_queue):
+        while not self.stop_event.is_set():
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END_OF_STREAM
@@ -0,0 +1,2 @@
+from .stats_panel import StatsPanel
+from .stats_engine import PlayerStatsEngine
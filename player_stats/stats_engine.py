@@ -0,0 +1,159 @@
+import sys
+from bisect import bisect_right
+
+sys.path.append("../")
+import constants
+
+from utils import convert_pixel_distance_to_meters, measure_distance
+
+
+class PlayerStatsEngine:
+    # Keeps running per-player counters (shots, shot speed, player speed, distance covered), updated in O(1) on every shot
+    # A snapshot of the counters is stored per shot, the stats of a frame are the last snapshot at or before it, found by binary search
+    # Shot frames can be fed all at once (add_shots) or one by one as frames stream in (add_shot_frame)
+    def __init__(self, mini_court_width, fps=24, player_ids=(1, 2)):
+        # Width of the mini court in pixels, used to convert mini court distances to meters
+        self.mini_court_width = mini_court_width
+        self.fps = fps
+        self.player_ids = player_ids
+
+        self.counters = {}
+        for player_id in player_ids:
+            self.counters.update(
+                {
+                    f"player_{player_id}_number_of_shots": 0,
+                    f"player_{player_id}_total_shot_speed": 0,
+                    f"player_{player_id}_last_shot_speed": 0,
+                    f"player_{player_id}_total_player_speed": 0,
+                    f"player_{player_id}_last_player_speed": 0,
+                    f"player_{player_id}_distance_covered": 0,
+                }
+            )
+
+        # Frame numbers of the snapshots and the counters from each one on
+        self.snapshot_frames = [0]
+        self.snapshots = [dict(self.counters)]
+
+        # Last shot frame seen by add_shot_frame, with the mini court positions at that frame
+        self.last_shot = None
+
+    # Converts a distance on the mini court to meters
+    def get_distance_in_meters(self, position_1, position_2):
+        return convert_pixel_distance_to_meters(
+            measure_distance(position_1, position_2),
+            constants.DOUBLE_LINE_WIDTH,
+            self.mini_court_width,
+        )
+
+    # Updates the counters with the shot played between start_frame and end_frame (the next shot)
+    # Positions are the mini court {player_id: (x, y)} dictionaries and ball (x, y) positions at both frames
+    def add_shot(
+        self,
+        start_frame,
+        end_frame,
+        player_positions_start,
+        player_positions_end,
+        ball_position_start,
+        ball_position_end,
+    ):
+        # Time duration of the ball shot in seconds
+        ball_shot_time_in_seconds = (end_frame - start_frame) / self.fps
+
+        # Speed of the ball shot in kilometers per hour (km/h)
+        speed_of_ball_shot = (
+            self.get_distance_in_meters(ball_position_start, ball_position_end)
+            / ball_shot_time_in_seconds
+            * 3.6
+        )
+
+        # The player who shot the ball is the closest one to it at the start frame
+        player_shot_ball = min(
+            player_positions_start.keys(),
+            key=lambda player_id: measure_distance(
+                player_positions_start[player_id], ball_position_start
+            ),
+        )
+        opponent_player_id = 1 if player_shot_ball == 2 else 2
+
+        # Distance and speed of the opponent during the shot
+        distance_covered_by_opponent = self.get_distance_in_meters(
+            player_positions_start[opponent_player_id],
+            player_positions_end[opponent_player_id],
+        )
+        speed_of_opponent = (
+            distance_covered_by_opponent / ball_shot_time_in_seconds * 3.6
+        )
+
+        counters = self.counters
+        counters[f"player_{player_shot_ball}_number_of_shots"] += 1
+        counters[f"player_{player_shot_ball}_total_shot_speed"] += speed_of_ball_shot
+        counters[f"player_{player_shot_ball}_last_shot_speed"] = speed_of_ball_shot
+        counters[f"player_{opponent_player_id}_total_player_speed"] += speed_of_opponent
+        counters[f"player_{opponent_player_id}_last_player_speed"] = speed_of_opponent
+        counters[f"player_{opponent_player_id}_distance_covered"] += (
+            distance_covered_by_opponent
+        )
+
+        # A shot at the frame of the previous snapshot replaces it
+        if self.snapshot_frames[-1] == start_frame:
+            self.snapshots[-1] = dict(counters)
+        else:
+            self.snapshot_frames.append(start_frame)
+            self.snapshots.append(dict(counters))
+
+    # Streaming input: called on every detected shot frame with the mini court positions at that frame
+    # The previous shot is counted once the next one is known, as its speeds depend on both frames
+    def add_shot_frame(self, frame_num, player_positions, ball_position):
+        if self.last_shot is not None:
+            start_frame, player_positions_start, ball_position_start = self.last_shot
+            self.add_shot(
+                start_frame,
+                frame_num,
+                player_positions_start,
+                player_positions,
+                ball_position_start,
+                ball_position,
+            )
+        self.last_shot = (frame_num, player_positions, ball_position)
+
+    # Streaming input: called on a shot frame whose positions cannot be measured, the pending shot ends there uncounted instead of being measured across it
+    def skip_shot_frame(self):
+        self.last_shot = None
+
+    # Batch input: counts every shot from the shot frames and the per-frame mini court detections
+    def add_shots(
+        self, ball_shot_frames, player_mini_court_detections, ball_mini_court_detections
+    ):
+        for frame_num in ball_shot_frames:
+            self.add_shot_frame(
+                frame_num,
+                player_mini_court_detections[frame_num],
+                ball_mini_court_detections[frame_num][1],
+            )
+
+    # Returns the counters and average speeds in effect at a frame
+    def get_frame_stats(self, frame_num):
+        stats = dict(self.snapshots[bisect_right(self.snapshot_frames, frame_num) - 1])
+
+        for player_id in self.player_ids:
+            opponent_player_id = 1 if player_id == 2 else 2
+            number_of_shots = stats[f"player_{player_id}_number_of_shots"]
+            number_of_opponent_shots = stats[
+                f"player_{opponent_player_id}_number_of_shots"
+            ]
+
+            # A player runs while the opponent shoots, so the player speed is averaged over the opponent's shots
+            # Averages stay undefined (NaN) until there is a shot to average over
+            stats[f"player_{player_id}_average_shot_speed"] = (
+                stats[f"player_{player_id}_total_shot_speed"] / number_of_shots
+                if number_of_shots
+                else float("nan")
+            )
+            stats[f"player_{player_id}_average_player_speed"] = (
+                stats[f"player_{player_id}_total_player_speed"]
+                / number_of_opponent_shots
+                if number_of_opponent_shots
+                else float("nan")
+            )
+
+        return stats
@@ -0,0 +1,97 @@
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.append("../")
+from utils import Sprite
+
+
+class StatsPanel:
+    # Draws the player stats box in the bottom right part of the frame
+    # The text is rasterised into a cached sprite only when the displayed values change, every frame then blends the box and the text sprites over the box area
+    def __init__(self):
+        # Dimensions of the overlay rectangle
+        self.width = 350
+        self.height = 230
+
+        # Semi-transparent black rectangle
+        self.box_sprite = Sprite(
+            np.zeros((self.height + 1, self.width + 1, 3), np.uint8),
+            np.full((self.height + 1, self.width + 1), 0.5, np.float32),
+        )
+
+        self.text_sprite = None
+        self.text_sprite_texts = None
+
+    # Draws the stats of one frame on it in place
+    # stats holds the last and average shot and player speeds of both players
+    def draw(self, frame, stats):
+        texts = tuple(
+            f"{stats[f'player_1_{name}']:.1f} km/h    {stats[f'player_2_{name}']:.1f} km/h"
+            for name in (
+                "last_shot_speed",
+                "last_player_speed",
+                "average_shot_speed",
+                "average_player_speed",
+            )
+        )
+
+        # Calculate the start coordinates for the overlay rectangle
+        # On small frames (640x480...) they can be negative, the sprites only blend the part of the box inside the frame
+        start_x = frame.shape[1] - 400
+        start_y = frame.shape[0] - 500
+
+        if texts != self.text_sprite_texts:
+            self.text_sprite = self.rasterise(texts, frame.shape[1] - start_x)
+            self.text_sprite_texts = texts
+
+        self.box_sprite.blend_into(frame, start_x, start_y)
+        return self.text_sprite.blend_into(frame, start_x, start_y)
+
+    # Rasterises the labels and the given value texts, the sprite spans sprite_width pixels so text running past the box is kept
+    def rasterise(self, texts, sprite_width):
+        image = np.zeros((self.height + 1, sprite_width, 3), np.uint8)
+
+        # Draw text labels for player statistics
+        cv2.putText(
+            image,
+            "     Player 1     Player 2",
+            (80, 30),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            (255, 255, 255),
+            2,
+        )
+
+        labels = ("Shot Speed", "Player Speed", "avg. S. Speed", "avg. P. Speed")
+        for row, (label, text) in enumerate(zip(labels, texts)):
+            y = 80 + row * 40
+
+            # Draw the label
+            cv2.putText(
+                image,
+                label,
+                (10, y),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.45,
+                (255, 255, 255),
+                1,
+            )
+
+            # Draw the values of both players
+            cv2.putText(
+                image,
+                text,
+                (130, y),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                (255, 255, 255),
+                2,
+            )
+
+        # White text, its anti-aliased coverage becomes the opacity
+        alpha = image[..., 0] / np.float32(255)
+        image[:] = 255
+
+        return Sprite(image, alpha)
@@ -0,0 +1,20 @@
+class FrameRenderer:
+    # Annotates every frame in a single pass: each overlay registers a draw callback, and all callbacks draw on the frame in place, in the order they were added
+    def __init__(self):
+        self.overlays = []
+
+    # Adds an overlay, a function draw(frame, frame_num) drawing on the frame in place
+    def add_overlay(self, name, draw):
+        self.overlays.append((name, draw))
+        return self
+
+    # Draws every overlay on one frame
+    def render_frame(self, frame, frame_num):
+        for _, draw in self.overlays:
+            draw(frame, frame_num)
+        return frame
+
+    # Draws every overlay on the frames (a list or a generator), yielding them one at a time
+    def render(self, frames):
+        for frame_num, frame in enumerate(frames):
+            yield self.render_frame(frame, frame_num)
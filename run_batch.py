@@ -0,0 +1,108 @@
+import argparse
+import json
+
+from batch import list_match_videos, run_batch
+from court_line_detector import COURT_MODEL_MODES
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tennis match analysis of a batch of match videos"
+    )
+    parser.add_argument(
+        "source",
+        help="directory of match videos, or manifest file listing one video path per line",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="output_videos/batch",
+        help="directory receiving the annotated videos, their metrics, the checkpoint and the batch report",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="number of worker processes, each one loading the models once and analysing one match at a time",
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="torch threads of each worker (the CPU cores split between the workers by default)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="analyse every match again instead of resuming from the checkpoint",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="frames per model call"
+    )
+    parser.add_argument(
+        "--projection",
+        choices=["keypoint", "homography"],
+        default="keypoint",
+        help="map positions onto the mini court from the closest keypoint or through the court homography",
+    )
+    parser.add_argument(
+        "--court-tracking",
+        action="store_true",
+        help="re-detect the court keypoints on camera changes instead of using the first frame for the whole video",
+    )
+    parser.add_argument(
+        "--court-model-mode",
+        choices=list(COURT_MODEL_MODES),
+        default="eager",
+        help="inference mode of the court keypoints model",
+    )
+    parser.add_argument(
+        "--ball-search-window",
+        type=int,
+        default=None,
+        help="side in pixels (a multiple of 32) of the window around the predicted ball position searched instead of the whole frame",
+    )
+    parser.add_argument(
+        "--player-stride",
+        type=int,
+        default=1,
+        help="detect players on at most every Nth frame and interpolate the boxes in between",
+    )
+    parser.add_argument(
+        "--court-roi",
+        action="store_true",
+        help="run player and ball detection only on a padded box around the court",
+    )
+    parser.add_argument(
+        "--ball-estimator",
+        choices=["interpolate", "kalman"],
+        default="interpolate",
+        help="fill missing ball positions by linear interpolation or with a Kalman filter that also smooths them",
+    )
+    parser.add_argument(
+        "--codec",
+        default="MJPG",
+        help="FourCC of the output video codec, e.g. MJPG, mp4v, avc1 or XVID",
+    )
+    args = parser.parse_args()
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    report = run_batch(
+        list_match_videos(args.source),
+        args.output_dir,
+        number_of_workers=args.workers,
+        court_model_mode=args.court_model_mode,
+        num_threads=args.threads_per_worker,
+        resume=not args.restart,
+        options={
+            "batch_size": args.batch_size,
+            "projection": args.projection,
+            "court_tracking": args.court_tracking,
+            "ball_search_window": args.ball_search_window,
+            "player_stride": args.player_stride,
+            "court_roi": args.court_roi,
+            "ball_estimator": args.ball_estimator,
+            "codec": args.codec,
+        },
+    )
+    print(json.dumps(report["run"], indent=2))
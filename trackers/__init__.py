@@ -1,2 +1,5 @@
 from .player_tracker import PlayerTracker
-from .ball_tracker import BallTracker
\ No newline at end of file
+from .ball_tracker import BallTracker
+from .ball_search_window import BallSearchWindow
+from .ball_trajectory import BallTrajectoryEstimator
+from .detection_cache import DetectionCache, detect_frames_with_cache
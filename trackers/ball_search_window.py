@@ -0,0 +1,78 @@
+class BallSearchWindow:
+    # Predicts where the ball is on the next frames from its last two detections with a constant velocity model
+    # The ball detector then only runs on a window around the prediction, the window grows with every frame predicted ahead of the last detection
+    # Once the ball was missed on more than max_missed_frames frames in a row there is no prediction, so the whole frame is searched again
+    # A batch of frames is searched in runs of max_frames_ahead + 1 frames, so windows are never predicted further ahead of the last update
+    def __init__(
+        self, window_size=320, window_growth=16, max_missed_frames=3, max_frames_ahead=3
+    ):
+        # Side of the square search window in pixels, also the model input size on the window (a multiple of 32)
+        self.window_size = window_size
+        # Pixels added to each side of the window per frame between the last detection and the predicted frame
+        self.window_growth = window_growth
+        self.max_missed_frames = max_missed_frames
+        self.max_frames_ahead = max_frames_ahead
+
+        self.reset()
+
+    # Forgets the ball, for a new video
+    def reset(self):
+        # Number of frames seen so far, the next frame given to update is frame_num
+        self.frame_num = 0
+
+        # (frame_num, (x, y)) of the last two detections, oldest first
+        self.last_detections = []
+
+    # Predicts the centre of the ball frames_ahead frames after the last frame given to update, None when the ball is lost
+    def predict_center(self, frames_ahead=0):
+        if not self.last_detections:
+            return None
+
+        frame_num = self.frame_num + frames_ahead
+        last_frame_num, (last_x, last_y) = self.last_detections[-1]
+        if self.frame_num - last_frame_num - 1 > self.max_missed_frames:
+            return None
+
+        if len(self.last_detections) == 1:
+            return last_x, last_y
+
+        previous_frame_num, (previous_x, previous_y) = self.last_detections[0]
+        frames_between = last_frame_num - previous_frame_num
+        velocity_x = (last_x - previous_x) / frames_between
+        velocity_y = (last_y - previous_y) / frames_between
+
+        return (
+            last_x + velocity_x * (frame_num - last_frame_num),
+            last_y + velocity_y * (frame_num - last_frame_num),
+        )
+
+    # Returns the (x1, y1, x2, y2) window to search frames_ahead frames after the last frame given to update, kept inside the frame, or None to search the whole frame
+    def get_window(self, frame_shape, frames_ahead=0):
+        center = self.predict_center(frames_ahead)
+        if center is None:
+            return None
+
+        frame_height, frame_width = frame_shape[:2]
+        frames_since_detection = (
+            self.frame_num + frames_ahead - self.last_detections[-1][0]
+        )
+        half_size = self.window_size // 2 + self.window_growth * frames_since_detection
+
+        # Windows as big as the frame bring nothing
+        if 2 * half_size >= min(frame_width, frame_height):
+            return None
+
+        # Shift the window back inside the frame rather than cropping it, so the window keeps its size
+        x1 = min(max(int(center[0]) - half_size, 0), frame_width - 2 * half_size)
+        y1 = min(max(int(center[1]) - half_size, 0), frame_height - 2 * half_size)
+
+        return x1, y1, x1 + 2 * half_size, y1 + 2 * half_size
+
+    # Moves on to the next frame with its ball dictionary
+    def update(self, ball_dict):
+        if 1 in ball_dict:
+            x1, y1, x2, y2 = ball_dict[1]
+            self.last_detections = self.last_detections[-1:] + [
+                (self.frame_num, ((x1 + x2) / 2, (y1 + y2) / 2))
+            ]
+        self.frame_num += 1
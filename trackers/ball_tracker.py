@@ -1,156 +1,343 @@
 import pickle
+import sys
+import time
+
 import cv2
+import numpy as np
 import pandas as pd
-from ultralytics import YOLO
+from numpy.lib.stride_tricks import sliding_window_view
+
+sys.path.append("../")
+from utils import Detections, iter_frame_batches
+
+from .ball_trajectory import BallTrajectoryEstimator
+from .detection_cache import detect_frames_with_cache
 
 
 class BallTracker:
-    def __init__(self, model_path):
-        self.model = YOLO(model_path)
+    # With a BallSearchWindow, frames where the ball position can be predicted are only searched around that prediction
+    # With a court ROI (x1, y1, x2, y2), frames searched whole are cropped to that part
+    # The model is only loaded when detection first needs it, so runs reading the detections from stubs or a cache never import ultralytics
+    # An already loaded model can be passed to share it between videos
+    def __init__(self, model_path, search_window=None, roi=None, model=None):
+        self.model_path = model_path
+        self.model = model
+
+        # Seconds taken to load the model and by the warm-up call, None until they happen here
+        self.load_time = None
+        self.warm_up_time = None
+
+        # Parameters of the model calls, also part of the detection cache key
+        self.inference_params = {"conf": 0.2}
+
+        self.search_window = search_window
+        self.roi = roi
+
+        # Frames searched in a search window, and those of them where the ball was not found there and the whole frame was searched too
+        self.windowed_frames = 0
+        self.window_fallbacks = 0
 
     # Processes a list of frames to detect balls and returns a list of ball detections, while saving/reading to/from a stub file
-    def detect_frames(self, frames, read_from_stub=False, stub_path=None):
+    # Stub paths ending in .pkl are pickles, any other path holds columnar Detections (an .npz archive or a directory of memory-mapped .npy files)
+    # Frames are sent to the model batch_size at a time to cut down the per-call overhead
+    # With a DetectionCache (and the path of the video the frames come from), only the frames missing from the cache go through the model
+    def detect_frames(
+        self,
+        frames,
+        read_from_stub=False,
+        stub_path=None,
+        batch_size=1,
+        cache=None,
+        video_path=None,
+    ):
         ball_detections = []
 
         if read_from_stub and stub_path is not None:
+            if Detections.is_columnar_path(stub_path):
+                return Detections.load(stub_path)
             with open(stub_path, "rb") as f:
                 ball_detections = pickle.load(f)
             return ball_detections
 
-        for frame in frames:
-            ball_dict = self.detect_frame(frame)
-            ball_detections.append(ball_dict)
+        if self.search_window is not None:
+            self.search_window.reset()
+
+        if cache is not None:
+            cache_key = cache.get_key(
+                video_path, self.model_path, self.get_cache_params()
+            )
+            return detect_frames_with_cache(
+                frames,
+                cache,
+                cache_key,
+                self.detect_batch,
+                batch_size=batch_size,
+            )
+
+        for batch in iter_frame_batches(frames, batch_size):
+            ball_detections.extend(self.detect_batch(batch))
 
         if stub_path is not None:
-            with open(stub_path, "wb") as f:
-                pickle.dump(ball_detections, f)
+            if Detections.is_columnar_path(stub_path):
+                Detections.from_list(ball_detections).save(stub_path)
+            else:
+                with open(stub_path, "wb") as f:
+                    pickle.dump(ball_detections, f)
 
         return ball_detections
 
+    # Returns the model, loading it on first use
+    def load_model(self):
+        if self.model is None:
+            from ultralytics import YOLO
+
+            start_time = time.perf_counter()
+            self.model = YOLO(self.model_path)
+            self.load_time = time.perf_counter() - start_time
+        return self.model
+
+    # Loads the model and runs it once on a whole frame, so its cold start is paid and measured here instead of in the first detections
+    def warm_up(self, frame):
+        self.load_model()
+        start_time = time.perf_counter()
+        self.detect_whole_frames([frame])
+        self.warm_up_time = time.perf_counter() - start_time
+        return self.warm_up_time
+
+    # Parameters that change the detections, the inference parameters and the detection modes in use
+    def get_cache_params(self):
+        cache_params = dict(self.inference_params)
+        if self.search_window is not None:
+            cache_params["search_window"] = self.search_window.window_size
+        if self.roi is not None:
+            cache_params["roi"] = list(self.roi)
+        return cache_params
+
     # Processes a SINGLE frame to detect and track balls, returning a dictionary of ball IDs and their corresponding bounding box coordinates
     def detect_frame(self, frame):
-        results = self.model.predict(frame, conf=0.2)[0]
-
-        ball_dict = {}
-        for box in results.boxes:
-            result = box.xyxy.tolist()[0]
-            ball_dict[1] = result
-
-        return ball_dict
+        return self.detect_batch([frame])[0]
+
+    # Processes a batch of consecutive frames, returning one ball dictionary per frame
+    # Without a search window the frames go through the model in one call
+    # With one they go through it in runs of max_frames_ahead + 1 frames, whose windows are predicted from the detections of the previous runs
+    def detect_batch(self, frames):
+        if self.search_window is None:
+            return self.detect_whole_frames(frames)
+
+        run_length = self.search_window.max_frames_ahead + 1
+        ball_dicts = []
+        for start in range(0, len(frames), run_length):
+            ball_dicts.extend(
+                self.detect_windowed_run(frames[start : start + run_length])
+            )
+        return ball_dicts
+
+    # Searches the predicted windows of a run of frames first, then the frames where there was no window or the ball was not found in it go through the model whole
+    def detect_windowed_run(self, frames):
+        ball_dicts = [None] * len(frames)
+        windows = [
+            self.search_window.get_window(frame.shape, frames_ahead)
+            for frames_ahead, frame in enumerate(frames)
+        ]
+
+        windowed_frames = [i for i, window in enumerate(windows) if window is not None]
+        if windowed_frames:
+            crops = [
+                frames[i][windows[i][1] : windows[i][3], windows[i][0] : windows[i][2]]
+                for i in windowed_frames
+            ]
+            # Windows always go through the model at their own size, whatever the input size of whole frames
+            results = self.load_model().predict(
+                crops,
+                **{**self.inference_params, "imgsz": self.search_window.window_size},
+            )
+            offsets = [windows[i][:2] for i in windowed_frames]
+            for i, ball_dict in zip(
+                windowed_frames, self.get_ball_dicts(results, offsets)
+            ):
+                if ball_dict:
+                    ball_dicts[i] = ball_dict
+                else:
+                    self.window_fallbacks += 1
+            self.windowed_frames += len(windowed_frames)
+
+        # Fall back to the whole frame where there was no window or the ball was not in it
+        full_frames = [i for i, ball_dict in enumerate(ball_dicts) if ball_dict is None]
+        if full_frames:
+            for i, ball_dict in zip(
+                full_frames, self.detect_whole_frames([frames[i] for i in full_frames])
+            ):
+                ball_dicts[i] = ball_dict
+
+        for ball_dict in ball_dicts:
+            self.search_window.update(ball_dict)
+
+        return ball_dicts
+
+    # Runs the model on whole frames, or on their court ROI if there is one
+    def detect_whole_frames(self, frames):
+        if self.roi is None:
+            return self.get_ball_dicts(
+                self.load_model().predict(frames, **self.inference_params)
+            )
 
-    # Takes video frames and ball detections, then draws bounding boxes around balls with their IDs and returns the modified frames
+        x1, y1, x2, y2 = self.roi
+        results = self.load_model().predict(
+            [frame[y1:y2, x1:x2] for frame in frames], **self.inference_params
+        )
+        return self.get_ball_dicts(results, [(x1, y1)] * len(frames))
+
+    # Turns model results into ball dictionaries, offsets are the (x, y) frame positions of the top left corners of cropped inputs
+    def get_ball_dicts(self, results, offsets=None):
+        if offsets is None:
+            offsets = [(0, 0)] * len(results)
+
+        ball_dicts = []
+        for result, (offset_x, offset_y) in zip(results, offsets):
+            ball_dict = {}
+            for box in result.boxes:
+                x1, y1, x2, y2 = box.xyxy.tolist()[0]
+                ball_dict[1] = [
+                    x1 + offset_x,
+                    y1 + offset_y,
+                    x2 + offset_x,
+                    y2 + offset_y,
+                ]
+
+            ball_dicts.append(ball_dict)
+
+        return ball_dicts
+
+    # Takes video frames and ball detections, then draws bounding boxes around balls with their IDs and yields the modified frames one at a time
     def draw_bboxes(self, video_frames, ball_detections):
-        output_video_frames = []
         for frame, ball_dict in zip(video_frames, ball_detections):
-            # Draw Bounding Boxes
-            for track_id, bbox in ball_dict.items():
-                x1, y1, x2, y2 = bbox
-                cv2.putText(
-                    frame,
-                    f"Ball ID: {track_id}",
-                    (int(bbox[0]), int(bbox[1] - 10)),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.9,
-                    (0, 255, 255),
-                    2,
-                )
-                cv2.rectangle(
-                    frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 255), 2
-                )
-            output_video_frames.append(frame)
-
-        return output_video_frames
-
-    # Takes a list of ball positions, converts it into a Pandas DataFrame, interpolates missing values, and returns the interpolated ball positions
-    def interpolate_ball_positions(self, ball_positions):
-        ball_positions = [x.get(1, []) for x in ball_positions]
+            yield self.draw_bboxes_on_frame(frame, ball_dict)
+
+    # Draws the bounding boxes and IDs of one frame's balls on the frame in place
+    def draw_bboxes_on_frame(self, frame, ball_dict):
+        for track_id, bbox in ball_dict.items():
+            x1, y1, x2, y2 = bbox
+            cv2.putText(
+                frame,
+                f"Ball ID: {track_id}",
+                (int(bbox[0]), int(bbox[1] - 10)),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.9,
+                (0, 255, 255),
+                2,
+            )
+            cv2.rectangle(
+                frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 255), 2
+            )
 
-        # Convert the list into Pandas DataFrame
-        df_ball_positions = pd.DataFrame(
-            ball_positions, columns=["x1", "y1", "x2", "y2"]
-        )
+        return frame
 
-        # Interpolate the missing values
-        df_ball_positions = df_ball_positions.interpolate()
+    # Returns the ball boxes of every frame as a (frames, 4) array (NaN where there is no ball) and a (frames,) mask of the frames with a ball
+    def get_ball_bboxes(self, ball_positions):
+        if isinstance(ball_positions, Detections):
+            ball_bboxes, ball_mask = ball_positions.to_dense([1])
+            return ball_bboxes[:, 0], ball_mask[:, 0]
 
-        # Backfill positions if no detections on first frame
-        df_ball_positions = df_ball_positions.bfill()
+        ball_bboxes = np.array(
+            [x.get(1, [np.nan] * 4) for x in ball_positions], dtype=np.float64
+        ).reshape(-1, 4)
+        ball_mask = ~np.isnan(ball_bboxes).any(axis=1)
+        return ball_bboxes, ball_mask
 
-        # Convert back into original list style
-        ball_positions = [{1: x} for x in df_ball_positions.to_numpy().tolist()]
+    # Takes ball positions (a list of per-frame dictionaries or Detections), linearly interpolates the missing frames and returns the interpolated ball positions in the same format
+    def interpolate_ball_positions(self, ball_positions):
+        ball_bboxes, ball_mask = self.get_ball_bboxes(ball_positions)
+
+        if ball_mask.any():
+            # Interpolate the missing values, frames before the first detection take its position (backfill) and frames after the last one keep its position
+            frame_nums = np.arange(len(ball_bboxes))
+            ball_bboxes = np.stack(
+                [
+                    np.interp(frame_nums, frame_nums[ball_mask], column[ball_mask])
+                    for column in ball_bboxes.T
+                ],
+                axis=1,
+            )
+            ball_mask = np.ones(len(ball_bboxes), bool)
 
-        return ball_positions
+        if isinstance(ball_positions, Detections):
+            return Detections.from_dense(ball_bboxes[:, None], ball_mask[:, None], [1])
 
-    # Processes ball positions to identify frames where a ball is hit (when y coord changes)
-    def get_ball_shot_frames(self, ball_positions):
-        ball_positions = [x.get(1, []) for x in ball_positions]
+        # Convert back into original list style
+        return [{1: x} for x in ball_bboxes.tolist()]
 
-        # Convert the list into Pandas DataFrame
-        df_ball_positions = pd.DataFrame(
-            ball_positions, columns=["x1", "y1", "x2", "y2"]
-        )
+    # Takes ball positions (a list of per-frame dictionaries or Detections), fills and smooths them with a BallTrajectoryEstimator and returns them in the same format
+    # Unlike interpolate_ball_positions, long misses at the end of a rally stay empty instead of holding the last position
+    def estimate_ball_positions(self, ball_positions, estimator=None):
+        if estimator is None:
+            estimator = BallTrajectoryEstimator(max_lag=None)
+
+        ball_bboxes, ball_mask = self.get_ball_bboxes(ball_positions)
+        ball_bboxes, ball_mask, _ = estimator.estimate(ball_bboxes, ball_mask)
 
-        df_ball_positions["ball_hit"] = 0
+        if isinstance(ball_positions, Detections):
+            return Detections.from_dense(ball_bboxes[:, None], ball_mask[:, None], [1])
 
-        df_ball_positions["mid_y"] = (
-            df_ball_positions["y1"] + df_ball_positions["y2"]
-        ) / 2
+        return [
+            {1: bbox} if present else {}
+            for bbox, present in zip(ball_bboxes.tolist(), ball_mask.tolist())
+        ]
 
-        df_ball_positions["mid_y_rolling_mean"] = (
-            df_ball_positions["mid_y"]
-            .rolling(window=5, min_periods=1, center=False)
+    # Processes ball positions to identify frames where a ball is hit (when y coord changes)
+    # A frame is a hit when the ball's vertical direction flips on the next frame and stays flipped for at least minimum_change_frames_for_hit of the following change_window frames
+    def get_ball_shot_frames(
+        self,
+        ball_positions,
+        minimum_change_frames_for_hit=25,
+        change_window=None,
+        rolling_window=5,
+    ):
+        if change_window is None:
+            change_window = int(minimum_change_frames_for_hit * 1.2)
+
+        ball_bboxes, _ = self.get_ball_bboxes(ball_positions)
+        mid_y = (ball_bboxes[:, 1] + ball_bboxes[:, 3]) / 2
+
+        # Smooth with the same rolling mean as before so the direction changes are found on identical values
+        mid_y_rolling_mean = (
+            pd.Series(mid_y)
+            .rolling(window=rolling_window, min_periods=1, center=False)
             .mean()
+            .to_numpy()
         )
 
-        df_ball_positions["delta_y"] = df_ball_positions["mid_y_rolling_mean"].diff()
-
-        minimum_change_frames_for_hit = 25
-
-        for i in range(
-            1, len(df_ball_positions) - int(minimum_change_frames_for_hit * 1.2)
-        ):
-            negative_position_change = (
-                df_ball_positions["delta_y"].iloc[i] > 0
-                and df_ball_positions["delta_y"].iloc[i + 1] < 0
-            )
-
-            positive_position_change = (
-                df_ball_positions["delta_y"].iloc[i] < 0
-                and df_ball_positions["delta_y"].iloc[i + 1] > 0
-            )
+        delta_y = np.diff(mid_y_rolling_mean, prepend=np.nan)
+        moving_down = delta_y > 0
+        moving_up = delta_y < 0
+
+        # Candidate frames i run from 1 to len - change_window - 1, each looking at the frames i + 1 to i + change_window
+        number_of_candidates = len(delta_y) - change_window - 1
+        if number_of_candidates <= 0:
+            return []
+
+        candidates = slice(1, 1 + number_of_candidates)
+        next_frames = slice(2, 2 + number_of_candidates)
+
+        # Frames where the direction flips between i and i + 1
+        negative_position_change = moving_down[candidates] & moving_up[next_frames]
+        positive_position_change = moving_up[candidates] & moving_down[next_frames]
+
+        # Number of frames going the opposite way in the change window following each candidate
+        up_frames_in_window = sliding_window_view(moving_up, change_window)[
+            next_frames
+        ].sum(axis=1)
+        down_frames_in_window = sliding_window_view(moving_down, change_window)[
+            next_frames
+        ].sum(axis=1)
+
+        ball_hit = (
+            negative_position_change
+            & (up_frames_in_window >= minimum_change_frames_for_hit)
+        ) | (
+            positive_position_change
+            & (down_frames_in_window >= minimum_change_frames_for_hit)
+        )
 
-            # Ientify frames where a ball is hit based on changes in the y-coordinate of the ball position
-            if negative_position_change or positive_position_change:
-                change_count = 0
-                for change_frame in range(
-                    i + 1, i + int(minimum_change_frames_for_hit * 1.2) + 1
-                ):
-                    negative_position_change_following_frame = (
-                        df_ball_positions["delta_y"].iloc[i] > 0
-                        and df_ball_positions["delta_y"].iloc[change_frame] < 0
-                    )
-
-                    positive_position_change_following_frame = (
-                        df_ball_positions["delta_y"].iloc[i] < 0
-                        and df_ball_positions["delta_y"].iloc[change_frame] > 0
-                    )
-
-                    if (
-                        negative_position_change
-                        and negative_position_change_following_frame
-                    ):
-                        change_count += 1
-                    elif (
-                        positive_position_change
-                        and positive_position_change_following_frame
-                    ):
-                        change_count += 1
-
-                if change_count > minimum_change_frames_for_hit - 1:
-                    df_ball_positions.loc[i, "ball_hit"] = 1
-
-        frame_nums_with_ball_hits = df_ball_positions[
-            df_ball_positions["ball_hit"] == 1
-        ].index.tolist()
+        frame_nums_with_ball_hits = (np.flatnonzero(ball_hit) + 1).tolist()
 
         return frame_nums_with_ball_hits
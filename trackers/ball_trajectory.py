@@ -0,0 +1,203 @@
+from collections import deque
+
+import numpy as np
+
+
+class BallTrajectoryEstimator:
+    # Online ball trajectory estimator: a constant velocity Kalman filter on the ball centre, fed one frame at a time
+    # Every frame comes out max_lag frames after it went in (all at the end with max_lag=None), with a filled and smoothed box and a confidence
+    # Misses followed by a detection within the lag are interpolated between the two filtered positions, other misses are extrapolated for up to max_extrapolation frames and left empty after that
+    # Confidence is 1 on detected frames and halves every confidence_half_life frames away from the closest detection, 0 on empty frames
+    def __init__(
+        self,
+        max_lag=12,
+        max_extrapolation=6,
+        process_noise=200.0,
+        measurement_noise=9.0,
+        confidence_half_life=6.0,
+    ):
+        self.max_lag = max_lag
+        self.max_extrapolation = max_extrapolation
+        self.confidence_half_life = confidence_half_life
+
+        # State transition and measurement of (x, y, velocity x, velocity y)
+        self.transition = np.array(
+            [[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], np.float64
+        )
+        self.measurement = np.eye(2, 4)
+
+        # Noise of a constant velocity model driven by random accelerations, and of the detected centres
+        self.process_covariance = process_noise * np.array(
+            [
+                [1 / 4, 0, 1 / 2, 0],
+                [0, 1 / 4, 0, 1 / 2],
+                [1 / 2, 0, 1, 0],
+                [0, 1 / 2, 0, 1],
+            ]
+        )
+        self.measurement_covariance = measurement_noise * np.eye(2)
+
+        self.reset()
+
+    # Forgets the ball, for a new video
+    def reset(self):
+        self.frame_num = 0
+        self.state = None
+        self.covariance = None
+
+        # Frames not given out yet, as [frame_num, centre, size, kind, frames to the closest detection] with kind one of detected, filled, predicted or empty
+        self.pending_frames = deque()
+
+        # (frame_num, centre, size) of the last detection
+        self.last_detection = None
+
+    def get_confidence(self, frames_to_detection):
+        return 0.5 ** (frames_to_detection / self.confidence_half_life)
+
+    # Runs the filter on the next frame's ball dictionary and returns the (ball_dict, confidence) of the frames that are now final, oldest first
+    def update(self, ball_dict):
+        frame_num = self.frame_num
+        self.frame_num += 1
+
+        if self.state is not None:
+            self.state = self.transition @ self.state
+            self.covariance = (
+                self.transition @ self.covariance @ self.transition.T
+                + self.process_covariance
+            )
+
+        if 1 in ball_dict:
+            x1, y1, x2, y2 = ball_dict[1]
+            centre = np.array([(x1 + x2) / 2, (y1 + y2) / 2])
+            size = np.array([x2 - x1, y2 - y1])
+            self.add_detection(frame_num, centre, size)
+        elif (
+            self.state is not None
+            and frame_num - self.last_detection[0] <= self.max_extrapolation
+        ):
+            self.pending_frames.append(
+                [
+                    frame_num,
+                    self.state[:2].copy(),
+                    self.last_detection[2],
+                    "predicted",
+                    frame_num - self.last_detection[0],
+                ]
+            )
+        else:
+            # Lost for too long, the velocity is stale so the next detection starts a new track
+            self.state = None
+            self.pending_frames.append([frame_num, None, None, "empty", None])
+
+        final_frames = []
+        while self.pending_frames and (
+            self.max_lag is not None
+            and frame_num - self.pending_frames[0][0] >= self.max_lag
+        ):
+            final_frames.append(self.get_output(self.pending_frames.popleft()))
+        return final_frames
+
+    # Corrects the filter with a detected centre and fills the pending frames since the previous detection
+    def add_detection(self, frame_num, centre, size):
+        if self.state is None:
+            self.state = np.array([centre[0], centre[1], 0.0, 0.0])
+            self.covariance = np.diag(
+                [
+                    self.measurement_covariance[0, 0],
+                    self.measurement_covariance[1, 1],
+                    1e4,
+                    1e4,
+                ]
+            )
+        else:
+            innovation = centre - self.measurement @ self.state
+            innovation_covariance = (
+                self.measurement @ self.covariance @ self.measurement.T
+                + self.measurement_covariance
+            )
+            gain = (
+                self.covariance
+                @ self.measurement.T
+                @ np.linalg.inv(innovation_covariance)
+            )
+            self.state = self.state + gain @ innovation
+            self.covariance = (np.eye(4) - gain @ self.measurement) @ self.covariance
+
+        filtered_centre = self.state[:2].copy()
+
+        # Pending misses since the previous detection are interpolated, pending frames before the first detection take its position
+        for pending_frame in self.pending_frames:
+            pending_frame_num, _, _, kind, _ = pending_frame
+            if kind not in ("predicted", "empty"):
+                continue
+
+            if (
+                self.last_detection is not None
+                and pending_frame_num > self.last_detection[0]
+            ):
+                last_frame_num, last_centre, last_size = self.last_detection
+                weight = (pending_frame_num - last_frame_num) / (
+                    frame_num - last_frame_num
+                )
+                pending_frame[1] = (
+                    last_centre + (filtered_centre - last_centre) * weight
+                )
+                pending_frame[2] = last_size + (size - last_size) * weight
+                pending_frame[3] = "filled"
+                pending_frame[4] = min(
+                    pending_frame_num - last_frame_num, frame_num - pending_frame_num
+                )
+            elif self.last_detection is None:
+                pending_frame[1] = filtered_centre
+                pending_frame[2] = size
+                pending_frame[3] = "filled"
+                pending_frame[4] = frame_num - pending_frame_num
+
+        self.pending_frames.append([frame_num, filtered_centre, size, "detected", 0])
+        self.last_detection = (frame_num, filtered_centre, size)
+
+    def get_output(self, pending_frame):
+        _, centre, size, kind, frames_to_detection = pending_frame
+        if kind == "empty":
+            return {}, 0.0
+
+        x1, y1 = centre - size / 2
+        x2, y2 = centre + size / 2
+        return (
+            {1: [float(x1), float(y1), float(x2), float(y2)]},
+            self.get_confidence(frames_to_detection),
+        )
+
+    # Returns the (ball_dict, confidence) of the frames still pending, at the end of the video
+    def flush(self):
+        final_frames = [
+            self.get_output(pending_frame) for pending_frame in self.pending_frames
+        ]
+        self.pending_frames.clear()
+        return final_frames
+
+    # Yields the (ball_dict, confidence) of every frame of a stream of ball dictionaries, each at most max_lag frames after it came in
+    def iter_estimates(self, ball_dicts):
+        self.reset()
+        for ball_dict in ball_dicts:
+            yield from self.update(ball_dict)
+        yield from self.flush()
+
+    # Batch mode over array-backed detections: (frames, 4) boxes and a (frames,) mask
+    # Returns the estimated (frames, 4) boxes (NaN where empty), their mask and the (frames,) confidences
+    def estimate(self, ball_bboxes, ball_mask):
+        estimates = list(
+            self.iter_estimates(
+                {1: bbox} if present else {}
+                for bbox, present in zip(ball_bboxes.tolist(), ball_mask.tolist())
+            )
+        )
+
+        estimated_bboxes = np.full((len(estimates), 4), np.nan)
+        confidences = np.zeros(len(estimates))
+        for frame_num, (ball_dict, confidence) in enumerate(estimates):
+            if ball_dict:
+                estimated_bboxes[frame_num] = ball_dict[1]
+            confidences[frame_num] = confidence
+
+        return estimated_bboxes, confidences > 0, confidences
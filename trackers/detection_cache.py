@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import time
+from collections import deque
+
+sys.path.append("../")
+from utils import iter_frame_batches, match_track_ids
+
+
+class DetectionCache:
+    # Stores per-frame detections in a SQLite file, keyed on the video content, the model weights and the inference parameters
+    # Entries are evicted least recently used first once the stored detections go over max_size_bytes
+    def __init__(self, cache_path, max_size_bytes=512 * 1024 * 1024):
+        self.cache_path = cache_path
+        self.max_size_bytes = max_size_bytes
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS detections (
+                cache_key TEXT NOT NULL,
+                frame_num INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (cache_key, frame_num)
+            );
+            CREATE INDEX IF NOT EXISTS detections_last_access
+                ON detections (last_access);
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            """
+        )
+
+    # Hashes the content of a file, the hash is remembered until the file's size or modification time changes
+    def get_file_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        row = self.connection.execute(
+            "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?",
+            (path, stat.st_size, stat.st_mtime),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        file_hash = sha256.hexdigest()
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, file_hash),
+            )
+        return file_hash
+
+    # Builds the key of a detection run from the video content, the model weights and the inference parameters
+    # Models given by name (downloaded by ultralytics) are identified by that name
+    def get_key(self, video_path, model_path, inference_params):
+        if os.path.isfile(model_path):
+            model_hash = self.get_file_hash(model_path)
+        else:
+            model_hash = model_path
+
+        key = {
+            "video": self.get_file_hash(video_path),
+            "model": model_hash,
+            "params": inference_params,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    # Returns the cached detections of a key as a dictionary of frame number to detection dictionary
+    def get_detections(self, cache_key):
+        rows = self.connection.execute(
+            "SELECT frame_num, payload FROM detections WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchall()
+
+        with self.connection:
+            self.connection.execute(
+                "UPDATE detections SET last_access = ? WHERE cache_key = ?",
+                (time.time(), cache_key),
+            )
+
+        return {frame_num: pickle.loads(payload) for frame_num, payload in rows}
+
+    # Returns the number of frames cached under a key
+    def count_frames(self, cache_key):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM detections WHERE cache_key = ?", (cache_key,)
+        ).fetchone()[0]
+
+    # Stores the detections of some frames (a dictionary of frame number to detection dictionary) and evicts old entries if needed
+    def put_detections(self, cache_key, detections):
+        now = time.time()
+        rows = []
+        for frame_num, detection in detections.items():
+            payload = pickle.dumps(detection)
+            rows.append((cache_key, frame_num, payload, len(payload), now))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?)", rows
+            )
+        self.evict()
+
+    # Deletes the least recently used frames until the cache fits in max_size_bytes
+    def evict(self):
+        total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM detections"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        to_delete = []
+        for rowid, size in self.connection.execute(
+            "SELECT rowid, size FROM detections ORDER BY last_access"
+        ):
+            if total_size <= self.max_size_bytes:
+                break
+            to_delete.append((rowid,))
+            total_size -= size
+
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM detections WHERE rowid = ?", to_delete
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+# Runs detect_batch only on the frames missing from the cache and stores their detections, returning the detections of every frame
+# Detections are stored after every batch, so an interrupted run keeps the frames it finished
+# With warmup_frames, each run of missing frames starts by re-detecting up to that many cached frames before it, so the new track IDs can be matched to the cached ones
+def detect_frames_with_cache(
+    frames, cache, cache_key, detect_batch, batch_size=1, warmup_frames=0
+):
+    cached_detections = cache.get_detections(cache_key)
+    used_track_ids = {
+        track_id for detection in cached_detections.values() for track_id in detection
+    }
+    next_track_id = max(used_track_ids, default=0) + 1
+
+    detections = []
+    recent_cached_frames = deque(maxlen=warmup_frames)
+    missing_frames = []
+    id_mapping = None
+
+    # Detects the frames waiting in missing_frames and gives their tracks their reconciled IDs
+    def detect_missing_frames():
+        nonlocal next_track_id
+        for batch in iter_frame_batches(missing_frames, batch_size):
+            batch_detections = detect_batch([frame for _, frame in batch])
+            new_detections = {}
+            for (frame_num, _), detection in zip(batch, batch_detections):
+                if warmup_frames:
+                    for track_id in detection:
+                        if track_id not in id_mapping:
+                            if track_id in used_track_ids:
+                                id_mapping[track_id] = next_track_id
+                            else:
+                                id_mapping[track_id] = track_id
+                            used_track_ids.add(id_mapping[track_id])
+                            next_track_id = max(used_track_ids) + 1
+                    detection = {
+                        id_mapping[track_id]: bbox
+                        for track_id, bbox in detection.items()
+                    }
+                new_detections[frame_num] = detection
+                detections.append(detection)
+            cache.put_detections(cache_key, new_detections)
+        missing_frames.clear()
+
+    for frame_num, frame in enumerate(frames):
+        if frame_num in cached_detections:
+            detect_missing_frames()
+            id_mapping = None
+            detections.append(cached_detections[frame_num])
+            recent_cached_frames.append((frame_num, frame))
+            continue
+
+        # Start of a run of missing frames
+        if id_mapping is None:
+            id_mapping = {}
+            if warmup_frames and recent_cached_frames:
+                warmup_detections = [
+                    detection
+                    for batch in iter_frame_batches(
+                        [frame for _, frame in recent_cached_frames], batch_size
+                    )
+                    for detection in detect_batch(batch)
+                ]
+                id_mapping, next_track_id = match_track_ids(
+                    [cached_detections[n] for n, _ in recent_cached_frames],
+                    warmup_detections,
+                    next_track_id,
+                )
+                used_track_ids.update(id_mapping.values())
+            recent_cached_frames.clear()
+
+        missing_frames.append((frame_num, frame))
+        if len(missing_frames) == batch_size:
+            detect_missing_frames()
+
+    detect_missing_frames()
+
+    return detections
@@ -0,0 +1,96 @@
+import sys
+
+sys.path.append("../")
+from utils import get_center_of_bbox, measure_distance
+
+
+# Fills the frames between two detected keyframes by interpolating the boxes of the tracks detected on both, returning one dictionary per frame in between
+def interpolate_detections(start_detection, end_detection, number_of_frames_between):
+    detections = []
+    for i in range(1, number_of_frames_between + 1):
+        weight = i / (number_of_frames_between + 1)
+        detections.append(
+            {
+                track_id: [
+                    start + (end - start) * weight
+                    for start, end in zip(start_detection[track_id], bbox)
+                ]
+                for track_id, bbox in end_detection.items()
+                if track_id in start_detection
+            }
+        )
+    return detections
+
+
+# Largest distance a track's box centre moved between two detections
+def get_max_motion(start_detection, end_detection):
+    return max(
+        (
+            measure_distance(
+                get_center_of_bbox(start_detection[track_id]), get_center_of_bbox(bbox)
+            )
+            for track_id, bbox in end_detection.items()
+            if track_id in start_detection
+        ),
+        default=0,
+    )
+
+
+# Runs detect_batch only on every stride-th frame (and the last one) and interpolates the boxes of the frames in between, returning the detections of every frame
+# The stride starts at max_stride, it is halved after a batch where a track moved more than motion_threshold pixels between two detected frames and doubled back when they all moved less than half of it
+def detect_frames_with_stride(
+    frames, detect_batch, batch_size=1, max_stride=4, motion_threshold=24
+):
+    detections = []
+    stride = max_stride
+
+    # (frame_num, frame) of the keyframes waiting to be detected, and (frame_num, detection) of the last detected one
+    keyframes = []
+    last_keyframe = None
+
+    def detect_keyframes():
+        nonlocal last_keyframe, stride
+        if not keyframes:
+            return
+
+        batch_detections = detect_batch([frame for _, frame in keyframes])
+
+        max_motion = 0
+        for (frame_num, _), detection in zip(keyframes, batch_detections):
+            if last_keyframe is not None:
+                last_frame_num, last_detection = last_keyframe
+                detections.extend(
+                    interpolate_detections(
+                        last_detection, detection, frame_num - last_frame_num - 1
+                    )
+                )
+                max_motion = max(max_motion, get_max_motion(last_detection, detection))
+            detections.append(detection)
+            last_keyframe = (frame_num, detection)
+        keyframes.clear()
+
+        if max_motion > motion_threshold:
+            stride = max(stride // 2, 1)
+        elif max_motion < motion_threshold / 2:
+            stride = min(stride * 2, max_stride)
+
+    next_keyframe = 0
+    last_frame = None
+    last_frame_is_keyframe = False
+    for frame_num, frame in enumerate(frames):
+        last_frame = (frame_num, frame)
+        last_frame_is_keyframe = frame_num == next_keyframe
+        if not last_frame_is_keyframe:
+            continue
+
+        keyframes.append(last_frame)
+        if len(keyframes) == batch_size:
+            detect_keyframes()
+        next_keyframe = frame_num + stride
+
+    # The last frame is always detected, so every frame in between has detections on both sides
+    if last_frame is not None and not last_frame_is_keyframe:
+        keyframes.append(last_frame)
+    detect_keyframes()
+
+    return detections
@@ -1,74 +1,211 @@
 import pickle
 import sys
+import time
 
 import cv2
-from ultralytics import YOLO
 
 sys.path.append("../")
-from utils import get_center_of_bbox, measure_distance
+from utils import (
+    Detections,
+    get_center_of_bbox,
+    iter_frame_batches,
+    measure_distance,
+)
+
+from .detection_cache import detect_frames_with_cache
+from .detection_stride import detect_frames_with_stride
 
 
 class PlayerTracker:
-    def __init__(self, model_path):
-        self.model = YOLO(model_path)
+    # With max_stride above 1, detect_frames only runs the model on every few frames and interpolates the boxes in between
+    # The stride shrinks down to every frame when the players move more than motion_threshold pixels between two detected frames
+    # With a court ROI (x1, y1, x2, y2), only that part of the frames goes through the model and only people are detected
+    # The model is only loaded when detection first needs it, so runs reading the detections from stubs or a cache never import ultralytics
+    # An already loaded model can be passed to share it between videos, its tracks of the previous video are then forgotten
+    def __init__(
+        self, model_path, max_stride=1, motion_threshold=24, roi=None, model=None
+    ):
+        self.model_path = model_path
+        self.model = model
+        self.reset_tracking()
+
+        # Seconds taken to load the model and by the warm-up call, None until they happen here
+        self.load_time = None
+        self.warm_up_time = None
+
+        # Parameters of the model calls, also part of the detection cache key
+        self.inference_params = {"persist": True}
+
+        self.roi = roi
+        if roi is not None:
+            # COCO class 0, person
+            self.inference_params["classes"] = [0]
+
+        self.max_stride = max_stride
+        self.motion_threshold = motion_threshold
+
+        # Cached frames re-detected before each run of uncached frames, to match the new track IDs to the cached ones
+        self.cache_warmup_frames = 48
 
     # Processes a list of frames to detect players and returns a list of player detections, while saving/reading to/from a stub file
-    def detect_frames(self, frames, read_from_stub=False, stub_path=None):
+    # Stub paths ending in .pkl are pickles, any other path holds columnar Detections (an .npz archive or a directory of memory-mapped .npy files)
+    # Frames are sent to the model batch_size at a time to cut down the per-call overhead
+    # With a DetectionCache (and the path of the video the frames come from), only the frames missing from the cache go through the model
+    def detect_frames(
+        self,
+        frames,
+        read_from_stub=False,
+        stub_path=None,
+        batch_size=1,
+        cache=None,
+        video_path=None,
+    ):
         player_detections = []
 
         if read_from_stub and stub_path is not None:
+            if Detections.is_columnar_path(stub_path):
+                return Detections.load(stub_path)
             with open(stub_path, "rb") as f:
                 player_detections = pickle.load(f)
             return player_detections
 
-        for frame in frames:
-            player_dict = self.detect_frame(frame)
-            player_detections.append(player_dict)
+        if cache is not None:
+            cache_key = cache.get_key(
+                video_path, self.model_path, self.get_cache_params()
+            )
+
+            # Each chunk of missing frames is detected with the stride, so the cache still stores every frame
+            detect_batch = self.detect_batch
+            if self.max_stride > 1:
+                detect_batch = lambda chunk: self.detect_frames_with_stride(
+                    chunk, batch_size
+                )
+
+            return detect_frames_with_cache(
+                frames,
+                cache,
+                cache_key,
+                detect_batch,
+                batch_size=batch_size * self.max_stride,
+                warmup_frames=self.cache_warmup_frames,
+            )
+
+        if self.max_stride > 1:
+            player_detections = self.detect_frames_with_stride(frames, batch_size)
+        else:
+            for batch in iter_frame_batches(frames, batch_size):
+                player_detections.extend(self.detect_batch(batch))
 
         if stub_path is not None:
-            with open(stub_path, "wb") as f:
-                pickle.dump(player_detections, f)
+            if Detections.is_columnar_path(stub_path):
+                Detections.from_list(player_detections).save(stub_path)
+            else:
+                with open(stub_path, "wb") as f:
+                    pickle.dump(player_detections, f)
 
         return player_detections
 
+    # Returns the model, loading it on first use
+    def load_model(self):
+        if self.model is None:
+            from ultralytics import YOLO
+
+            start_time = time.perf_counter()
+            self.model = YOLO(self.model_path)
+            self.load_time = time.perf_counter() - start_time
+        return self.model
+
+    # Loads the model and runs it once on a frame, so its cold start is paid and measured here instead of in the first detections
+    # The tracks started by the warm-up are forgotten
+    def warm_up(self, frame):
+        self.load_model()
+        start_time = time.perf_counter()
+        self.detect_batch([frame])
+        self.warm_up_time = time.perf_counter() - start_time
+        self.reset_tracking()
+        return self.warm_up_time
+
+    # Forgets the tracks kept by the model between calls (persist=True), so a new video starts with new track IDs
+    def reset_tracking(self):
+        predictor = getattr(self.model, "predictor", None)
+        for tracker in getattr(predictor, "trackers", None) or []:
+            tracker.reset()
+
+    # Parameters that change the detections, the inference parameters and the detection modes in use
+    def get_cache_params(self):
+        cache_params = dict(self.inference_params)
+        if self.max_stride > 1:
+            cache_params["max_stride"] = self.max_stride
+            cache_params["motion_threshold"] = self.motion_threshold
+        if self.roi is not None:
+            cache_params["roi"] = list(self.roi)
+        return cache_params
+
+    # Detects players on every stride-th frame only, batch_size of those frames at a time, and interpolates the boxes of the frames in between
+    def detect_frames_with_stride(self, frames, batch_size=1):
+        return detect_frames_with_stride(
+            frames,
+            self.detect_batch,
+            batch_size=batch_size,
+            max_stride=self.max_stride,
+            motion_threshold=self.motion_threshold,
+        )
+
     # Processes a SINGLE frame to detect and track people, returning a dictionary of player IDs and their corresponding bounding box coordinates
     def detect_frame(self, frame):
-        results = self.model.track(frame, persist=True)[0]
-        id_name_dict = results.names
+        return self.detect_batch([frame])[0]
+
+    # Processes a batch of consecutive frames in one model call, returning one player dictionary per frame
+    # The frames of a batch go through the same tracker in order and persist=True keeps it between calls, so track IDs stay consistent across batches
+    # With a court ROI the frames are cropped to it and the boxes moved back to frame coordinates
+    def detect_batch(self, frames):
+        offset_x, offset_y = 0, 0
+        if self.roi is not None:
+            x1, y1, x2, y2 = self.roi
+            frames = [frame[y1:y2, x1:x2] for frame in frames]
+            offset_x, offset_y = x1, y1
+
+        results = self.load_model().track(frames, **self.inference_params)
 
-        player_dict = {}
-        for box in results.boxes:
-            track_id = int(box.id.tolist()[0])
-            result = box.xyxy.tolist()[0]
-            object_cls_id = box.cls.tolist()[0]
-            object_cls_name = id_name_dict[object_cls_id]
-            if object_cls_name == "person":
-                player_dict[track_id] = result
+        player_dicts = []
+        for result in results:
+            id_name_dict = result.names
 
-        return player_dict
+            player_dict = {}
+            for box in result.boxes:
+                track_id = int(box.id.tolist()[0])
+                x1, y1, x2, y2 = box.xyxy.tolist()[0]
+                bbox = [x1 + offset_x, y1 + offset_y, x2 + offset_x, y2 + offset_y]
+                object_cls_id = box.cls.tolist()[0]
+                object_cls_name = id_name_dict[object_cls_id]
+                if object_cls_name == "person":
+                    player_dict[track_id] = bbox
 
-    # Takes video frames and player detections, then draws bounding boxes around players with their IDs and returns the modified frames
+            player_dicts.append(player_dict)
+
+        return player_dicts
+
+    # Takes video frames and player detections, then draws bounding boxes around players with their IDs and yields the modified frames one at a time
     def draw_bboxes(self, video_frames, player_detections):
-        output_video_frames = []
         for frame, player_dict in zip(video_frames, player_detections):
-            # Draw Bounding Boxes
-            for track_id, bbox in player_dict.items():
-                x1, y1, x2, y2 = bbox
-                cv2.putText(
-                    frame,
-                    f"Player ID: {track_id}",
-                    (int(bbox[0]), int(bbox[1] - 10)),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.9,
-                    (0, 255, 0),
-                    2,
-                )
-                cv2.rectangle(
-                    frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2
-                )
-            output_video_frames.append(frame)
+            yield self.draw_bboxes_on_frame(frame, player_dict)
+
+    # Draws the bounding boxes and IDs of one frame's players on the frame in place
+    def draw_bboxes_on_frame(self, frame, player_dict):
+        for track_id, bbox in player_dict.items():
+            x1, y1, x2, y2 = bbox
+            cv2.putText(
+                frame,
+                f"Player ID: {track_id}",
+                (int(bbox[0]), int(bbox[1] - 10)),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.9,
+                (0, 255, 0),
+                2,
+            )
+            cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
 
-        return output_video_frames
+        return frame
 
     # Selects the two players with the shortest distance to the court keypoints based on their bounding box centers
     def choose_players(self, court_keypoints, player_detections):
@@ -103,6 +240,9 @@ class PlayerTracker:
             court_keypoints, player_detections_first_frame
         )
 
+        if isinstance(player_detections, Detections):
+            return player_detections.filter_tracks(chosen_player)
+
         filtered_player_detections = []
 
         for player_dict in player_detections:
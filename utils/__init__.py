@@ -1,13 +1,27 @@
-from .video_utils import read_video, save_video
+from .video_utils import (
+    AsyncVideoWriter,
+    get_video_frame_count,
+    get_video_properties,
+    iter_frame_batches,
+    iter_video_frames,
+    read_first_frame,
+    read_video,
+    save_video,
+)
 from .bbox_utils import (
     get_center_of_bbox,
     measure_distance,
     get_foot_position,
     get_closest_keypoint_index,
     get_height_of_bbox,
+    get_iou,
+    get_court_roi,
     measure_xy_distance,
 )
 from .conversions import (
     convert_pixel_distance_to_meters,
     convert_meters_to_pixel_distance,
 )
+from .track_utils import match_track_ids
+from .detections import Detections
+from .drawing_utils import Sprite
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def get_center_of_bbox(bbox):
     x1, y1, x2, y2 = bbox
     center_x = int((x1 + x2) / 2)
@@ -34,3 +37,33 @@ def get_height_of_bbox(bbox):
 
 def measure_xy_distance(p1, p2):
     return abs(p1[0] - p2[0]), abs(p1[1] - p2[1])
+
+
+def get_iou(bbox1, bbox2):
+    x1 = max(bbox1[0], bbox2[0])
+    y1 = max(bbox1[1], bbox2[1])
+    x2 = min(bbox1[2], bbox2[2])
+    y2 = min(bbox1[3], bbox2[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (
+        (bbox1[2] - bbox1[0]) * (bbox1[3] - bbox1[1])
+        + (bbox2[2] - bbox2[0]) * (bbox2[3] - bbox2[1])
+        - intersection
+    )
+    return intersection / union if union > 0 else 0.0
+
+
+def get_court_roi(court_keypoints, frame_shape, padding=0.2, top_padding=0.5):
+    keypoints = np.asarray(court_keypoints).reshape(-1, 2)
+    x_min, y_min = keypoints.min(axis=0)
+    x_max, y_max = keypoints.max(axis=0)
+    padding_x = (x_max - x_min) * padding
+    padding_y = (y_max - y_min) * padding
+    padding_top = (y_max - y_min) * top_padding
+
+    frame_height, frame_width = frame_shape[:2]
+    x1 = max(int(x_min - padding_x), 0)
+    y1 = max(int(y_min - padding_top), 0)
+    x2 = min(int(x_max + padding_x) + 1, frame_width)
+    y2 = min(int(y_max + padding_y) + 1, frame_height)
+    return x1, y1, x2, y2
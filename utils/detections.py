@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+
+# Names of the arrays making up a Detections object on disk
+_COLUMNS = ("frame_nums", "track_ids", "bboxes", "valid")
+
+
+class Detections:
+    # Columnar detections: one row per detected object with its frame number, track ID, x1/y1/x2/y2 box and a validity mask
+    # Rows are sorted by frame, invalid rows are placeholders (for example a frame slot of a dense array without a detection)
+    # Indexing or iterating gives the same per-frame {track_id: bbox} dictionaries as the list format, so existing code accepts it directly
+    def __init__(self, frame_nums, track_ids, bboxes, valid, number_of_frames):
+        self.frame_nums = frame_nums
+        self.track_ids = track_ids
+        self.bboxes = bboxes
+        self.valid = valid
+        self.number_of_frames = number_of_frames
+
+        # Row range of every frame, rows of frame i are frame_offsets[i]:frame_offsets[i + 1]
+        self.frame_offsets = np.searchsorted(
+            self.frame_nums, np.arange(number_of_frames + 1)
+        )
+
+    # Builds columnar detections from a list of per-frame {track_id: bbox} dictionaries
+    @classmethod
+    def from_list(cls, detections):
+        number_of_rows = sum(len(detection) for detection in detections)
+        frame_nums = np.empty(number_of_rows, np.int32)
+        track_ids = np.empty(number_of_rows, np.int32)
+        bboxes = np.empty((number_of_rows, 4), np.float64)
+
+        row = 0
+        for frame_num, detection in enumerate(detections):
+            for track_id, bbox in detection.items():
+                frame_nums[row] = frame_num
+                track_ids[row] = track_id
+                bboxes[row] = bbox[:4]
+                row += 1
+
+        valid = np.ones(number_of_rows, bool)
+        return cls(frame_nums, track_ids, bboxes, valid, len(detections))
+
+    # Builds columnar detections from a dense (frames, tracks, 4) box array and a (frames, tracks) mask
+    @classmethod
+    def from_dense(cls, bboxes, mask, track_ids):
+        number_of_frames, number_of_tracks = mask.shape
+        frame_nums = np.repeat(
+            np.arange(number_of_frames, dtype=np.int32), number_of_tracks
+        )
+        track_ids = np.tile(np.asarray(track_ids, np.int32), number_of_frames)
+        return cls(
+            frame_nums,
+            track_ids,
+            np.asarray(bboxes, np.float64).reshape(-1, 4),
+            np.asarray(mask, bool).reshape(-1),
+            number_of_frames,
+        )
+
+    # Converts back to a list of per-frame {track_id: bbox} dictionaries
+    def to_list(self):
+        return [self[frame_num] for frame_num in range(self.number_of_frames)]
+
+    # Returns a dense (frames, tracks, 4) box array (NaN where missing) and a (frames, tracks) mask for the given track IDs
+    def to_dense(self, track_ids=None):
+        if track_ids is None:
+            track_ids = self.get_track_ids()
+        track_ids = np.asarray(track_ids)
+
+        bboxes = np.full((self.number_of_frames, len(track_ids), 4), np.nan)
+        mask = np.zeros((self.number_of_frames, len(track_ids)), bool)
+        if len(track_ids) == 0:
+            return bboxes, mask
+
+        order = np.argsort(track_ids)
+        positions = np.searchsorted(track_ids, self.track_ids, sorter=order)
+        positions = np.minimum(positions, len(track_ids) - 1)
+        columns = order[positions]
+        rows = self.valid & (track_ids[columns] == self.track_ids)
+
+        bboxes[self.frame_nums[rows], columns[rows]] = self.bboxes[rows]
+        mask[self.frame_nums[rows], columns[rows]] = True
+        return bboxes, mask
+
+    # Returns the sorted IDs of the tracks with at least one valid detection
+    def get_track_ids(self):
+        return np.unique(self.track_ids[self.valid])
+
+    # Keeps only the detections of the given track IDs
+    def filter_tracks(self, track_ids):
+        rows = np.isin(self.track_ids, track_ids)
+        return Detections(
+            self.frame_nums[rows],
+            self.track_ids[rows],
+            self.bboxes[rows],
+            self.valid[rows],
+            self.number_of_frames,
+        )
+
+    def __len__(self):
+        return self.number_of_frames
+
+    # Returns the {track_id: bbox} dictionary of a frame
+    def __getitem__(self, frame_num):
+        if frame_num < 0:
+            frame_num += self.number_of_frames
+        if not 0 <= frame_num < self.number_of_frames:
+            raise IndexError(frame_num)
+
+        start, end = self.frame_offsets[frame_num], self.frame_offsets[frame_num + 1]
+        return {
+            int(track_id): bbox.tolist()
+            for track_id, bbox, valid in zip(
+                self.track_ids[start:end],
+                self.bboxes[start:end],
+                self.valid[start:end],
+            )
+            if valid
+        }
+
+    def __iter__(self):
+        for frame_num in range(self.number_of_frames):
+            yield self[frame_num]
+
+    # Saves the columns, as an .npz archive if the path ends with .npz, otherwise as one .npy file per column in a directory
+    def save(self, path):
+        columns = {name: getattr(self, name) for name in _COLUMNS}
+        columns["number_of_frames"] = np.array(self.number_of_frames)
+
+        if path.endswith(".npz"):
+            np.savez(path, **columns)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+
+    # Loads columns saved by save, a directory of .npy files is memory-mapped so loading costs no copy of the data
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        if path.endswith(".npz"):
+            with np.load(path) as archive:
+                columns = {name: archive[name] for name in archive.files}
+        else:
+            columns = {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                for name in _COLUMNS + ("number_of_frames",)
+            }
+
+        number_of_frames = int(columns.pop("number_of_frames"))
+        return cls(**columns, number_of_frames=number_of_frames)
+
+    # Tells whether a stub path refers to columnar detections rather than a pickle
+    @staticmethod
+    def is_columnar_path(path):
+        return not path.endswith((".pkl", ".pickle"))
@@ -0,0 +1,34 @@
+import numpy as np
+
+
+class Sprite:
+    # A pre-rendered overlay: BGR pixels and a per-pixel opacity between 0 (transparent) and 1 (opaque)
+    # Blending it only touches the frame pixels under the sprite, so its cost does not depend on the frame resolution
+    def __init__(self, image, alpha):
+        self.image = image
+        self.alpha = alpha
+        self.height, self.width = image.shape[:2]
+
+        # Premultiplied colours and inverse opacity, so a blend is one multiply and one add per pixel
+        self.premultiplied_image = image.astype(np.float32) * alpha[..., None]
+        self.inverse_alpha = (1 - alpha[..., None]).astype(np.float32)
+
+    # Blends the sprite into the frame in place with its top left corner at (x, y), rounding like cv2.addWeighted
+    # The parts of the sprite outside the frame are left out, (x, y) can be negative
+    def blend_into(self, frame, x, y):
+        frame_height, frame_width = frame.shape[:2]
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + self.width, frame_width), min(y + self.height, frame_height)
+        if x1 >= x2 or y1 >= y2:
+            return frame
+
+        sprite_rows = slice(y1 - y, y2 - y)
+        sprite_columns = slice(x1 - x, x2 - x)
+        roi = frame[y1:y2, x1:x2]
+        blended = (
+            roi * self.inverse_alpha[sprite_rows, sprite_columns]
+            + self.premultiplied_image[sprite_rows, sprite_columns]
+        )
+        np.rint(blended, out=blended)
+        roi[:] = blended
+        return frame
@@ -0,0 +1,37 @@
+from .bbox_utils import get_iou
+
+
+# Maps new track IDs onto the IDs already given to the same objects over a run of overlapping frames, by average IoU
+# Tracks without a match get IDs from next_track_id onwards
+def match_track_ids(previous_detections, new_detections, next_track_id, min_iou=0.5):
+    iou_sums = {}
+    for previous_dict, new_dict in zip(previous_detections, new_detections):
+        for new_id, new_bbox in new_dict.items():
+            for previous_id, previous_bbox in previous_dict.items():
+                iou = get_iou(new_bbox, previous_bbox)
+                iou_sums[(new_id, previous_id)] = (
+                    iou_sums.get((new_id, previous_id), 0) + iou
+                )
+
+    number_of_overlap_frames = max(len(previous_detections), 1)
+
+    # Greedily pairs the tracks with the highest average IoU over the overlap
+    id_mapping = {}
+    used_previous_ids = set()
+    for (new_id, previous_id), iou_sum in sorted(
+        iou_sums.items(), key=lambda x: x[1], reverse=True
+    ):
+        if iou_sum / number_of_overlap_frames < min_iou:
+            break
+        if new_id in id_mapping or previous_id in used_previous_ids:
+            continue
+        id_mapping[new_id] = previous_id
+        used_previous_ids.add(previous_id)
+
+    for new_dict in new_detections:
+        for new_id in new_dict:
+            if new_id not in id_mapping:
+                id_mapping[new_id] = next_track_id
+                next_track_id += 1
+
+    return id_mapping, next_track_id
@@ -1,23 +1,143 @@
+import queue
+import threading
+import time
+
 import cv2
 
+# Reads a video file frame by frame and yields the frames one at a time, so only the current frame is held in memory
+# start_frame and end_frame restrict the reading to a segment of the video
+
+def iter_video_frames(video_path, start_frame=0, end_frame=None):
+    cap = cv2.VideoCapture(video_path)
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frame_num = start_frame
+    try:
+        while end_frame is None or frame_num < end_frame:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+            frame_num += 1
+    finally:
+        cap.release()
+
+# Returns the number of frames of a video file as reported by its container
+
+def get_video_frame_count(video_path):
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frame_count
+
+# Reads only the first frame of a video file
+
+def read_first_frame(video_path):
+    return next(iter_video_frames(video_path))
+
+# Groups frames (a list or a generator) into lists of up to batch_size consecutive frames
+
+def iter_frame_batches(frames, batch_size):
+    # A batch size below 1 would collect the whole video into one batch
+    if batch_size < 1:
+        raise ValueError(f'Batch size must be at least 1, got {batch_size}')
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 # Reads a video file frame by frame and returns a list of frames
 
 def read_video(video_path):
+    return list(iter_video_frames(video_path))
+
+# Returns the frame rate and (width, height) of a video file as reported by its container
+
+def get_video_properties(video_path):
     cap = cv2.VideoCapture(video_path)
-    frames = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
     cap.release()
-    return frames
+    return fps, frame_size
+
+class AsyncVideoWriter:
+    # Encodes frames on a background thread, so producing the next frames and encoding the previous ones overlap
+    # Frames go through a bounded queue: write() blocks when max_queue_size frames are waiting, so a slow encoder holds back the producer instead of piling up frames
+    # The container comes from the extension of the output path, the codec is a FourCC
+    # The frame size is the source's (width, height), or the size of the first frame when None
+    def __init__(self, output_video_path, fps=24, frame_size=None, codec='MJPG', max_queue_size=8):
+        self.output_video_path = output_video_path
+        self.fps = fps
+        self.frame_size = frame_size
+        self.codec = codec
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.frames_written = 0
+        # Seconds spent encoding and writing frames on the background thread
+        self.encode_seconds = 0.0
+
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _open(self, frame):
+        if self.frame_size is None:
+            self.frame_size = (frame.shape[1], frame.shape[0])
+        out = cv2.VideoWriter(self.output_video_path, cv2.VideoWriter_fourcc(*self.codec), self.fps, self.frame_size)
+        if not out.isOpened():
+            raise ValueError(f'Could not open {self.output_video_path} with codec {self.codec}')
+        return out
+
+    def _write(self):
+        out = None
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    break
+                start_time = time.perf_counter()
+                if out is None:
+                    out = self._open(frame)
+                out.write(frame)
+                self.encode_seconds += time.perf_counter() - start_time
+                self.frames_written += 1
+        except Exception as e:
+            self.error = e
+            # Keep emptying the queue so the producer never blocks on a dead encoder
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if out is not None:
+                out.release()
+
+    # Queues a frame for encoding, raising if the encoder failed
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    # Waits for every queued frame to be encoded and closes the file
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-# Saves a list of frames as a video
+# Saves frames as a video, each frame is handed to a background encoder as soon as it is produced (frames can be a list or a generator)
+# fps and frame_size should come from the source video, codec is a FourCC
+# Returns the closed writer, with the number of frames written and the time spent encoding them
 
-def save_video(output_video_frames, output_video_path):
-    fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-    out = cv2.VideoWriter(output_video_path, fourcc, 24, (output_video_frames[0].shape[1], output_video_frames[0].shape[0]))
-    for frame in output_video_frames:
-        out.write(frame)
-    out.release()
\ No newline at end of file
+def save_video(output_video_frames, output_video_path, fps=24, frame_size=None, codec='MJPG', max_queue_size=8):
+    with AsyncVideoWriter(output_video_path, fps=fps, frame_size=frame_size, codec=codec, max_queue_size=max_queue_size) as writer:
+        for frame in output_video_frames:
+            writer.write(frame)
+    return writer